@@ -4,14 +4,34 @@ from __future__ import annotations
 
 import abc
 import asyncio
-import collections
+import contextlib
+import copy
 import dataclasses
 import enum
-import itertools
+import functools
+import json
+import os
 import random
-from typing import Dict, Iterable, List, Optional, Set, Tuple
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    TextIO,
+    Tuple,
+    Union,
+)
 
 ASSASSINATE = "Select a member of the table to assasinate"
+BETRAY = "Betray the quest?"
+LADY = "Whose allegiance would you like the Lady of the Lake to reveal?"
 
 
 def quest_goes(go: bool) -> str:
@@ -86,6 +106,78 @@ class Role(enum.Enum):
     )
 
 
+ROLE_BITS = {role: 1 << idx for idx, role in enumerate(Role)}
+KNOWS = {
+    role: sum(ROLE_BITS[other] for other in Role if other.value.key in role.value.know)
+    for role in Role
+}
+
+
+def mask_seats(mask: int) -> List[int]:
+    seats = []
+    while mask:
+        low = mask & -mask
+        seats.append(low.bit_length() - 1)
+        mask ^= low
+    return seats
+
+
+class Seating:
+    __slots__ = ("roles", "names", "index", "role_seats", "evil", "known")
+
+    def __init__(self, roles: Sequence[Role], names: Sequence[str] = ()):
+        self.roles = tuple(roles)
+        self.names = tuple(names)
+        self.index = {name: seat for seat, name in enumerate(self.names)}
+        self.role_seats: Dict[Role, int] = {}
+        self.evil = 0
+        for seat, role in enumerate(self.roles):
+            bit = 1 << seat
+            self.role_seats[role] = self.role_seats.get(role, 0) | bit
+            if role.value.side is Side.EVIL:
+                self.evil |= bit
+        visible = {
+            role: sum(
+                mask
+                for other, mask in self.role_seats.items()
+                if KNOWS[role] & ROLE_BITS[other]
+            )
+            for role in self.role_seats
+        }
+        self.known = tuple(
+            visible[role] & ~(1 << seat) for seat, role in enumerate(self.roles)
+        )
+
+    def named(self, names: Sequence[str]) -> Seating:
+        seating = copy.copy(self)
+        seating.names = tuple(names)
+        seating.index = {name: seat for seat, name in enumerate(seating.names)}
+        return seating
+
+    def seat(self, name: str) -> int:
+        return self.index[name]
+
+    def seats(self, role: Role) -> List[int]:
+        return mask_seats(self.role_seats.get(role, 0))
+
+    def known_seats(self, seat: int) -> List[int]:
+        return mask_seats(self.known[seat])
+
+    def side(self, seat: int) -> Side:
+        return Side.EVIL if self.evil >> seat & 1 else Side.GOOD
+
+    def unique(self, role: Role) -> Optional[int]:
+        mask = self.role_seats.get(role, 0)
+        if mask and not mask & (mask - 1):
+            return mask.bit_length() - 1
+        return None
+
+
+@functools.lru_cache(maxsize=0x1000)
+def seating_for(roles: Tuple[Role, ...]) -> Seating:
+    return Seating(roles)
+
+
 class Flag(enum.Enum):
     NoQuests = 1
     Lady = 2
@@ -110,6 +202,26 @@ class Player(abc.ABC):
     async def input_vote(self, msg: str) -> bool: ...
 
 
+def selection_error(
+    names: Sequence[str],
+    roster: Sequence[str],
+    count: int,
+    exclude: Set[str],
+) -> Optional[str]:
+    if len(names) != count:
+        return f"Select exactly {count} {'player' if count == 1 else 'players'}"
+    unknown = [name for name in names if name not in roster]
+    if unknown:
+        return f"Unknown players: {' '.join(unknown)}"
+    if len(set(names)) != count:
+        return "Select each player at most once"
+    allowed = [name for name in roster if name not in exclude]
+    barred = [name for name in names if name in exclude]
+    if barred and len(allowed) >= count:
+        return f"Cannot select {' '.join(barred)}"
+    return None
+
+
 @dataclasses.dataclass
 class Quest:
     num_players: int
@@ -189,6 +301,502 @@ MAX_QUEST_VOTES = 4
 LADY_BEGINS_AFTER = 1
 
 
+@dataclasses.dataclass
+class Deadlines:
+    decision: float = 120.0
+    warnings: Tuple[float, ...] = (30.0,)
+    budget: Optional[float] = None
+    approve: bool = True
+
+
+def deal_roles(
+    nplayers: int,
+    roles: List[Role],
+    rules: Rules,
+    rng: random.Random,
+) -> List[Role]:
+    evils = rules.total_evil
+    goods = nplayers - evils
+    evil_roles = [r for r in roles if r.value.side == Side.EVIL]
+    good_roles = [r for r in roles if r.value.side == Side.GOOD]
+    if len(evil_roles) > evils:
+        raise ValueError("Too many evil roles")
+    if len(good_roles) > goods:
+        raise ValueError("Too many good roles")
+    evil_roles.extend([Role.Minion] * (evils - len(evil_roles)))
+    good_roles.extend([Role.Servant] * (goods - len(good_roles)))
+    all_roles = evil_roles + good_roles
+    rng.shuffle(all_roles)
+    return all_roles
+
+
+class Phase(enum.Enum):
+    NOMINATE = "nominate"
+    VOTE = "vote"
+    BETRAY = "betray"
+    LADY = "lady"
+    ASSASSINATE = "assassinate"
+    DONE = "done"
+
+
+@dataclasses.dataclass(frozen=True)
+class Decision:
+    phase: Phase
+    seat: int
+    vote: bool = False
+    seats: Tuple[int, ...] = ()
+
+
+@dataclasses.dataclass(frozen=True)
+class Prompt:
+    phase: Phase
+    seat: int
+    count: int = 1
+    exclude: FrozenSet[int] = frozenset()
+
+    def answer_vote(self, vote: bool) -> Decision:
+        return Decision(self.phase, self.seat, vote=vote)
+
+    def answer_seats(self, seats: Iterable[int]) -> Decision:
+        return Decision(self.phase, self.seat, seats=tuple(seats))
+
+
+@dataclasses.dataclass(frozen=True)
+class Dealt:
+    roles: Tuple[Role, ...]
+
+
+@dataclasses.dataclass(frozen=True)
+class QuestStarted:
+    index: int
+    quest: Quest
+
+
+@dataclasses.dataclass(frozen=True)
+class VoteStarted:
+    attempt: int
+
+
+@dataclasses.dataclass(frozen=True)
+class VotesExhausted:
+    pass
+
+
+@dataclasses.dataclass(frozen=True)
+class CommanderChosen:
+    seat: int
+
+
+@dataclasses.dataclass(frozen=True)
+class TeamNominated:
+    seats: Tuple[int, ...]
+
+
+@dataclasses.dataclass(frozen=True)
+class TeamVoted:
+    votes: Tuple[bool, ...]
+    approved: bool
+
+
+@dataclasses.dataclass(frozen=True)
+class QuestDeparted:
+    seats: Tuple[int, ...]
+
+
+@dataclasses.dataclass(frozen=True)
+class QuestCompleted:
+    index: int
+    betrayals: int
+    winner: Side
+
+
+@dataclasses.dataclass(frozen=True)
+class ScoreChanged:
+    good: int
+    evil: int
+
+
+@dataclasses.dataclass(frozen=True)
+class LadyVisited:
+    seat: int
+
+
+@dataclasses.dataclass(frozen=True)
+class LadyRevealed:
+    seat: int
+    target: int
+    side: Side
+
+
+@dataclasses.dataclass(frozen=True)
+class LadySkipped:
+    seat: int
+
+
+@dataclasses.dataclass(frozen=True)
+class AssassinationStarted:
+    pass
+
+
+@dataclasses.dataclass(frozen=True)
+class Assassinated:
+    seat: int
+    merlin: bool
+
+
+@dataclasses.dataclass(frozen=True)
+class GameWon:
+    side: Side
+
+
+Event = Union[
+    Dealt,
+    QuestStarted,
+    VoteStarted,
+    VotesExhausted,
+    CommanderChosen,
+    TeamNominated,
+    TeamVoted,
+    QuestDeparted,
+    QuestCompleted,
+    ScoreChanged,
+    LadyVisited,
+    LadyRevealed,
+    LadySkipped,
+    AssassinationStarted,
+    Assassinated,
+    GameWon,
+]
+
+
+@dataclasses.dataclass
+class State:
+    roles: List[Role]
+    rules: Rules
+    flags: Set[Flag]
+    phase: Phase = Phase.NOMINATE
+    quest: int = 0
+    attempt: int = 0
+    commander: int = -1
+    team: Tuple[int, ...] = ()
+    votes: Dict[int, bool] = dataclasses.field(default_factory=dict)
+    score: Dict[Side, int] = dataclasses.field(
+        default_factory=lambda: {s: 0 for s in Side}
+    )
+    lady: int = -1
+    lady_excludes: Set[int] = dataclasses.field(default_factory=set)
+    winner: Optional[Side] = None
+
+    @property
+    def nplayers(self) -> int:
+        return len(self.roles)
+
+
+class Recorder:
+    def started(self, state: State) -> None:
+        pass
+
+    def decided(self, decision: Decision) -> None:
+        pass
+
+    def finished(self, side: Side) -> None:
+        pass
+
+
+class Metrics:
+    def phase(self, phase: str, seconds: float) -> None:
+        pass
+
+    def decision(self, player: str, phase: str, seconds: float) -> None:
+        pass
+
+
+class Engine:
+    def __init__(
+        self,
+        roles: List[Role],
+        rules: Rules,
+        flags: Set[Flag],
+        recorder: Optional[Recorder] = None,
+        seating: Optional[Seating] = None,
+    ):
+        self.state = State(roles, rules, flags)
+        self.recorder = recorder
+        self.state.lady = len(roles) - 1
+        self.state.lady_excludes.add(self.state.lady)
+        self.seating = seating or seating_for(tuple(roles))
+        self.events: List[Event] = []
+
+    def drain(self) -> List[Event]:
+        events, self.events = self.events, []
+        return events
+
+    def start(self) -> None:
+        self.events.append(Dealt(tuple(self.state.roles)))
+        if self.recorder is not None:
+            self.recorder.started(self.state)
+        if Flag.NoQuests in self.state.flags:
+            self.state.phase = Phase.DONE
+            return
+        self.begin_quest()
+
+    def pending_decisions(self) -> List[Prompt]:
+        state = self.state
+        if state.phase is Phase.NOMINATE:
+            quest = state.rules.quests[state.quest]
+            return [Prompt(Phase.NOMINATE, state.commander, quest.num_players)]
+        if state.phase is Phase.VOTE:
+            return [
+                Prompt(Phase.VOTE, seat)
+                for seat in range(state.nplayers)
+                if seat not in state.votes
+            ]
+        if state.phase is Phase.BETRAY:
+            return [
+                Prompt(Phase.BETRAY, seat)
+                for seat in state.team
+                if seat not in state.votes
+            ]
+        if state.phase is Phase.LADY:
+            return [Prompt(Phase.LADY, state.lady, 1, frozenset(state.lady_excludes))]
+        if state.phase is Phase.ASSASSINATE:
+            assassin = self.seating.unique(Role.Assassin)
+            assert assassin is not None
+            return [Prompt(Phase.ASSASSINATE, assassin, 1)]
+        return []
+
+    def apply(self, decision: Decision) -> None:
+        self.step(decision)
+        if self.recorder is not None:
+            self.recorder.decided(decision)
+            if self.state.winner is not None:
+                self.recorder.finished(self.state.winner)
+
+    def step(self, decision: Decision) -> None:
+        state = self.state
+        if decision.phase is not state.phase:
+            raise ValueError(f"Unexpected decision {decision}")
+        if state.phase in (Phase.VOTE, Phase.BETRAY):
+            if state.phase is Phase.VOTE:
+                voters: Sequence[int] = range(state.nplayers)
+            else:
+                voters = state.team
+            if decision.seat not in voters or decision.seat in state.votes:
+                raise ValueError(f"Unexpected decision {decision}")
+            state.votes[decision.seat] = decision.vote
+            if len(state.votes) == len(voters):
+                if state.phase is Phase.VOTE:
+                    self.end_vote()
+                else:
+                    self.end_quest()
+            return
+        (prompt,) = self.pending_decisions()
+        if decision.seat != prompt.seat:
+            raise ValueError(f"Unexpected decision {decision}")
+        seats = decision.seats
+        if prompt.phase is Phase.LADY and not seats:
+            self.events.append(LadySkipped(state.lady))
+            state.quest += 1
+            self.begin_quest()
+            return
+        if len(seats) != prompt.count or len(set(seats)) != prompt.count:
+            raise ValueError(f"Expected {prompt.count} distinct players")
+        allowed = state.nplayers - len(prompt.exclude)
+        for seat in seats:
+            if not 0 <= seat < self.state.nplayers:
+                raise ValueError(f"Cannot select seat {seat}")
+            if seat in prompt.exclude and allowed >= prompt.count:
+                raise ValueError(f"Cannot select seat {seat}")
+        if prompt.phase is Phase.NOMINATE:
+            self.nominated(tuple(sorted(seats)))
+        elif prompt.phase is Phase.LADY:
+            self.revealed(seats[0])
+        else:
+            self.assassinated(seats[0])
+
+    def begin_quest(self) -> None:
+        state = self.state
+        if state.quest >= len(state.rules.quests):
+            raise ValueError("no victory")
+        self.events.append(QuestStarted(state.quest, state.rules.quests[state.quest]))
+        state.attempt = 0
+        self.begin_attempt()
+
+    def begin_attempt(self) -> None:
+        state = self.state
+        if state.attempt < MAX_QUEST_VOTES:
+            self.events.append(VoteStarted(state.attempt))
+        else:
+            self.events.append(VotesExhausted())
+        state.commander = (state.commander + 1) % state.nplayers
+        self.events.append(CommanderChosen(state.commander))
+        state.phase = Phase.NOMINATE
+
+    def nominated(self, team: Tuple[int, ...]) -> None:
+        state = self.state
+        state.team = team
+        state.votes = {}
+        self.events.append(TeamNominated(team))
+        if state.attempt < MAX_QUEST_VOTES:
+            state.phase = Phase.VOTE
+        else:
+            self.depart()
+
+    def end_vote(self) -> None:
+        state = self.state
+        votes = tuple(state.votes[seat] for seat in range(state.nplayers))
+        approved = votes.count(True) > votes.count(False)
+        self.events.append(TeamVoted(votes, approved))
+        state.votes = {}
+        if approved:
+            self.depart()
+        else:
+            state.attempt += 1
+            self.begin_attempt()
+
+    def depart(self) -> None:
+        self.events.append(QuestDeparted(self.state.team))
+        self.state.phase = Phase.BETRAY
+
+    def end_quest(self) -> None:
+        state = self.state
+        betrayals = sum(state.votes.values())
+        state.votes = {}
+        quest = state.rules.quests[state.quest]
+        if betrayals >= quest.required_fails:
+            winner = Side.EVIL
+        else:
+            winner = Side.GOOD
+        self.events.append(QuestCompleted(state.quest, betrayals, winner))
+        state.score[winner] += 1
+        self.events.append(ScoreChanged(state.score[Side.GOOD], state.score[Side.EVIL]))
+        leading_team, nr_wins = max(state.score.items(), key=lambda item: item[1])
+        if nr_wins > len(state.rules.quests) // 2:
+            self.finish(leading_team)
+        elif Flag.Lady in state.flags and state.quest >= LADY_BEGINS_AFTER:
+            self.events.append(LadyVisited(state.lady))
+            state.phase = Phase.LADY
+        else:
+            state.quest += 1
+            self.begin_quest()
+
+    def revealed(self, target: int) -> None:
+        state = self.state
+        side = self.seating.side(target)
+        self.events.append(LadyRevealed(state.lady, target, side))
+        state.lady = target
+        state.lady_excludes.add(target)
+        state.quest += 1
+        self.begin_quest()
+
+    def finish(self, leading_team: Side) -> None:
+        if leading_team is Side.GOOD:
+            assassin = self.seating.unique(Role.Assassin)
+            merlin = self.seating.unique(Role.Merlin)
+            if assassin is not None and merlin is not None:
+                self.events.append(AssassinationStarted())
+                self.state.phase = Phase.ASSASSINATE
+                return
+        self.won(leading_team)
+
+    def assassinated(self, seat: int) -> None:
+        merlin = self.state.roles[seat] is Role.Merlin
+        self.events.append(Assassinated(seat, merlin))
+        self.won(Side.EVIL if merlin else Side.GOOD)
+
+    def won(self, side: Side) -> None:
+        self.state.winner = side
+        self.state.phase = Phase.DONE
+        self.events.append(GameWon(side))
+
+
+@dataclasses.dataclass
+class Snapshot:
+    players: List[str]
+    roles: List[Role]
+    flags: Set[Flag]
+    rules: Rules
+    meta: Dict[str, Any]
+    decisions: List[Decision]
+
+
+class Checkpoint:
+    def __init__(self, path: str, meta: Optional[Dict[str, Any]] = None):
+        self.path = path
+        self.meta = meta or {}
+        self.file: Optional[TextIO] = None
+
+    def append(self, line: str) -> None:
+        assert self.file is not None
+        self.file.write(line)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    async def write(self, obj: Any) -> None:
+        line = json.dumps(obj, separators=(",", ":")) + "\n"
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.append, line)
+
+    async def start(self, game: Game) -> None:
+        self.file = open(self.path, "w")
+        rules = game.active_rules
+        await self.write(
+            {
+                "players": [player.name for player in game.players],
+                "roles": [role.name for role in game.engine.state.roles],
+                "flags": [flag.name for flag in game.flags],
+                "rules": [
+                    rules.total_evil,
+                    [[q.num_players, q.required_fails] for q in rules.quests],
+                ],
+                "meta": self.meta,
+            }
+        )
+
+    async def record(self, decisions: List[Decision]) -> None:
+        if self.file is None:
+            self.file = open(self.path, "a")
+        await self.write(
+            [[d.phase.value, d.seat, d.vote, list(d.seats)] for d in decisions]
+        )
+
+    def finish(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path)
+
+    @staticmethod
+    def load(path: str) -> Snapshot:
+        decisions: List[Decision] = []
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            offset = f.tell()
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("torn record")
+                    batch = json.loads(line)
+                except ValueError:
+                    os.truncate(path, offset)
+                    break
+                offset += len(line)
+                decisions.extend(
+                    Decision(Phase(phase), seat, vote, tuple(seats))
+                    for phase, seat, vote, seats in batch
+                )
+        total_evil, quests = header["rules"]
+        return Snapshot(
+            players=header["players"],
+            roles=[Role[role] for role in header["roles"]],
+            flags={Flag[flag] for flag in header["flags"]},
+            rules=Rules(total_evil, [Quest(*quest) for quest in quests]),
+            meta=header["meta"],
+            decisions=decisions,
+        )
+
+
 class Game:
     def __init__(
         self,
@@ -196,6 +804,14 @@ class Game:
         roles: List[Role],
         flags: Optional[Set[Flag]] = None,
         rules: Optional[Rules] = None,
+        rng: Optional[random.Random] = None,
+        batch: Optional[int] = None,
+        checkpoint: Optional[Checkpoint] = None,
+        deal: Optional[List[Role]] = None,
+        recorder: Optional[Recorder] = None,
+        metrics: Optional[Metrics] = None,
+        deadlines: Optional[Deadlines] = None,
+        watch: Optional[Callable[[str], None]] = None,
     ):
         self.players = players
         self.roles = roles
@@ -203,26 +819,25 @@ class Game:
         if flags is None:
             flags = set()
         self.flags = flags
-        self.lady_excludes: Set[str] = set()
-        self.set_next_lady_target(players[-1])
-        evils = self.active_rules.total_evil
-        goods = len(players) - evils
-        evil_roles = [r for r in roles if r.value.side == Side.EVIL]
-        good_roles = [r for r in roles if r.value.side == Side.GOOD]
-        if len(evil_roles) > evils:
-            raise ValueError("Too many evil roles")
-        if len(good_roles) > goods:
-            raise ValueError("Too many good roles")
-        evil_roles.extend([Role.Minion] * (evils - len(evil_roles)))
-        good_roles.extend([Role.Servant] * (goods - len(good_roles)))
-        all_roles = evil_roles + good_roles
-        random.shuffle(all_roles)
-        self.player_map = list(zip(players, all_roles))
-        self.commander_order = itertools.cycle(self.players)
-
-    def set_next_lady_target(self, player: Player) -> None:
-        self.next_lady_target = player
-        self.lady_excludes.add(player.name)
+        self.rng = rng if rng is not None else random.Random()
+        if deal is None:
+            deal = deal_roles(len(players), roles, self.active_rules, self.rng)
+        all_roles = deal
+        self.seating = seating_for(tuple(all_roles)).named(
+            [player.name for player in players]
+        )
+        self.batch = batch
+        self.outbox: Dict[Player, List[str]] = {}
+        self.outbox_size: Dict[Player, int] = {}
+        self.checkpoint = checkpoint
+        self.metrics = metrics
+        self.deadlines = deadlines
+        self.watch = watch
+        self.expires = float("inf")
+        self.engine = Engine(
+            all_roles, self.active_rules, self.flags, recorder, self.seating
+        )
+        self.started = False
 
     @staticmethod
     def bold(s: str) -> str:
@@ -250,29 +865,48 @@ class Game:
     def your_role(cls, role: Role) -> str:
         return f"Your role is {cls.bold(role.value.name)}"
 
+    async def send(self, player: Player, msg: str) -> None:
+        if self.batch is None:
+            await player.send(msg)
+            return
+        size = self.outbox_size.get(player, -1) + 1 + len(msg)
+        if size > self.batch and player in self.outbox:
+            await player.send("\n".join(self.outbox.pop(player)))
+            size = len(msg)
+        self.outbox.setdefault(player, []).append(msg)
+        self.outbox_size[player] = size
+
+    async def flush(self) -> None:
+        outbox, self.outbox = self.outbox, {}
+        self.outbox_size.clear()
+        await asyncio.gather(
+            *[player.send("\n".join(msgs)) for player, msgs in outbox.items()]
+        )
+
     async def broadcast(self, msg: str) -> None:
-        await asyncio.gather(*[player.send(msg) for player in self.players])
+        if self.watch is not None:
+            self.watch(msg)
+        if self.batch is None:
+            await asyncio.gather(*[player.send(msg) for player in self.players])
+            return
+        for player in self.players:
+            await self.send(player, msg)
 
-    async def vote(self, onwhat: str, players: List[Player]) -> Dict[str, bool]:
-        async def vote_one(player: Player) -> bool:
-            return await player.input_vote(onwhat)
+    @property
+    def player_map(self) -> List[Tuple[Player, Role]]:
+        return list(zip(self.players, self.seating.roles))
 
-        results = await asyncio.gather(*[vote_one(player) for player in players])
-        return {player.name: result for player, result in zip(players, results)}
+    def known_players(self, idx: int) -> List[Player]:
+        return [self.players[seat] for seat in self.seating.known_seats(idx)]
 
     async def send_initial_info(self, idx: int) -> None:
-        player, role = self.player_map[idx]
-        await player.send(f"Welcome to Avalon, {player.name}!")
-        await player.send(self.your_role(role))
-        know = []
-        for other_player, other_role in self.player_map:
-            if other_player is player:
-                continue
-            if other_role.value.key in role.value.know:
-                know.append(other_player.name)
+        player, role = self.players[idx], self.seating.roles[idx]
+        await self.send(player, f"Welcome to Avalon, {player.name}!")
+        await self.send(player, self.your_role(role))
+        know = [other_player.name for other_player in self.known_players(idx)]
         if know:
-            await player.send("Here are the players you should know about:")
-            await player.send(" ".join(know))
+            await self.send(player, "Here are the players you should know about:")
+            await self.send(player, " ".join(know))
 
     async def input_players(
         self,
@@ -283,11 +917,14 @@ class Game:
     ) -> List[Player]:
         if exclude is None:
             exclude = set()
-        group = await selector.input_players(msg, count, exclude)
-        assert len(group) == count
-        knights = [player for player in self.players if player.name in group]
-        assert len(knights) == count
-        return knights
+        seating = self.seating
+        while True:
+            group = await selector.input_players(msg, count, exclude)
+            error = selection_error(group, seating.names, count, exclude)
+            if error is None:
+                break
+            await selector.send(error)
+        return [self.players[seat] for seat in sorted(map(seating.seat, group))]
 
     _num_to_word = {
         1: "one",
@@ -297,22 +934,6 @@ class Game:
         5: "five",
     }
 
-    async def nominate(self, quest: Quest) -> Tuple[List[Player], str]:
-        commander = next(self.commander_order)
-        await self.broadcast(f"The residing lord commander is {commander.name}")
-        how_many = self.bold(f"{self._num_to_word[quest.num_players]} knights")
-        knights = await self.input_players(
-            commander,
-            f"Lord commander! Select {how_many} to go on this quest!",
-            quest.num_players,
-            None,
-        )
-        knight_names = " ".join([k.name for k in knights])
-        await self.broadcast(
-            f"The lord commander nominates {knight_names} for this quest!"
-        )
-        return knights, knight_names
-
     @staticmethod
     def capitalize(s: str) -> str:
         return s[0].upper() + s[1:]
@@ -328,135 +949,220 @@ class Game:
     def knight_s(n: int) -> str:
         return "knight" + ("s" if n > 1 else "")
 
-    async def quest(self, quest: Quest) -> Side:
-        verb_s = "" if quest.required_fails > 1 else "s"
-        to_go = self.bold(
-            f"{self.capitalize(self._num_to_word[quest.num_players])} knights"
-        )
-        to_betray = self.bold(
-            f"{self._num_to_word[quest.required_fails]} {self.knight_s(quest.required_fails)} "
-        )
-        await self.broadcast(
-            "\n".join(
-                [
-                    "=" * 40,
-                    "We are going on a quest!",
-                    f"{to_go} will go on this quest",
-                    f"This quest will fail if {to_betray} betray{verb_s} us",
-                ]
-            )
-        )
+    def names(self, seats: Iterable[int]) -> str:
+        return " ".join([self.players[seat].name for seat in seats])
 
-        for itry in range(MAX_QUEST_VOTES):
+    async def announce(self, event: Event) -> None:
+        if isinstance(event, Dealt):
+            await asyncio.gather(
+                *[self.send_initial_info(idx) for idx in range(len(self.players))]
+            )
+        elif isinstance(event, QuestStarted):
+            quest = event.quest
+            verb_s = "" if quest.required_fails > 1 else "s"
+            to_go = self.bold(
+                f"{self.capitalize(self._num_to_word[quest.num_players])} knights"
+            )
+            to_betray = self.bold(
+                f"{self._num_to_word[quest.required_fails]} {self.knight_s(quest.required_fails)} "
+            )
             await self.broadcast(
-                f"The {self.bold(self._num_to_ordinal[itry+1])} vote for this quest will begin shortly"
+                "\n".join(
+                    [
+                        "=" * 40,
+                        "We are going on a quest!",
+                        f"{to_go} will go on this quest",
+                        f"This quest will fail if {to_betray} betray{verb_s} us",
+                    ]
+                )
             )
-            knights, knight_names = await self.nominate(quest)
-            go_vote = await self.vote(
-                f"Should {knight_names} go on a quest?", self.players
+        elif isinstance(event, VoteStarted):
+            await self.broadcast(
+                f"The {self.bold(self._num_to_ordinal[event.attempt+1])} vote for this quest will begin shortly"
             )
-            ctr = collections.Counter(go_vote.values())
-            go = ctr[True] > ctr[False]
+        elif isinstance(event, VotesExhausted):
+            await self.broadcast(
+                "All votes have failed! The lord commander alone shall select the knights for the next quest!"
+            )
+        elif isinstance(event, CommanderChosen):
+            commander = self.players[event.seat]
+            await self.broadcast(f"The residing lord commander is {commander.name}")
+        elif isinstance(event, TeamNominated):
+            await self.broadcast(
+                f"The lord commander nominates {self.names(event.seats)} for this quest!"
+            )
+        elif isinstance(event, TeamVoted):
             await self.broadcast(
                 "\n".join(
                     [
                         "The table voted thus:",
                         *[
-                            k + ": " + self.bold("aye" if v else "nay")
-                            for k, v in go_vote.items()
+                            player.name + ": " + self.bold("aye" if v else "nay")
+                            for player, v in zip(self.players, event.votes)
                         ],
-                        quest_goes(go),
+                        quest_goes(event.approved),
                     ]
                 )
             )
-            if go:
-                break
-        else:
+        elif isinstance(event, QuestDeparted):
+            await self.broadcast(going_on_a_quest(self.names(event.seats)))
+        elif isinstance(event, QuestCompleted):
+            betrayals = event.betrayals
+            if betrayals:
+                how_many = self.bold(
+                    f"{self._num_to_word[betrayals]} {self.knight_s(betrayals)}"
+                )
+                await self.broadcast(f"We have been betrayed by {how_many}")
+            else:
+                none = self.bold("None")
+                await self.broadcast(f"{none} of the knights betrayed us")
+            await self.broadcast(self.quest_result(event.winner))
+        elif isinstance(event, ScoreChanged):
+            score = {Side.GOOD: event.good, Side.EVIL: event.evil}
             await self.broadcast(
-                "All votes have failed! The lord commander alone shall select the knights for the next quest!"
+                "Current score:\n"
+                + ("\n".join([self.bold(s.value + ": " + str(score[s])) for s in Side]))
             )
-            knights, knight_names = await self.nominate(quest)
-
-        await self.broadcast(going_on_a_quest(knight_names))
-        quest_vote = await self.vote("Betray the quest?", knights)
-        ctr = collections.Counter(quest_vote.values())
-        betrayals = ctr[True]
-        if betrayals:
-            how_many = self.bold(
-                f"{self._num_to_word[betrayals]} {self.knight_s(betrayals)}"
+        elif isinstance(event, LadyVisited):
+            target = self.players[event.seat]
+            await self.broadcast(f"The lady of the Lake visits {target.name}")
+        elif isinstance(event, LadyRevealed):
+            target = self.players[event.seat]
+            chosen = self.players[event.target]
+            await self.send(target, self.lady_reveal(chosen.name, event.side))
+            await self.broadcast(
+                f"The Lady of the Lake revealed the allegiance of {chosen.name} to {target.name}"
             )
-            await self.broadcast(f"We have been betrayed by {how_many}")
-        else:
-            none = self.bold("None")
-            await self.broadcast(f"{none} of the knights betrayed us")
-        if betrayals >= quest.required_fails:
-            winner = Side.EVIL
+        elif isinstance(event, LadySkipped):
+            target = self.players[event.seat]
+            await self.broadcast(
+                f"The Lady of the Lake reveals nothing to {target.name}"
+            )
+        elif isinstance(event, AssassinationStarted):
+            await self.broadcast(
+                "The forces of evil have one last chance to win by murdering Merlin"
+            )
+        elif isinstance(event, Assassinated):
+            murdered = self.players[event.seat]
+            yes_or_no = "not " if not event.merlin else ""
+            this_is_merlin = self.bold(f"This is {yes_or_no}Merlin!")
+            await self.broadcast(
+                f"The assassin has murdered {murdered.name}! {this_is_merlin}"
+            )
+        elif isinstance(event, GameWon):
+            await self.broadcast(self.victory(event.side))
+
+    async def decide(self, prompt: Prompt) -> Decision:
+        player = self.players[prompt.seat]
+        if prompt.phase is Phase.VOTE:
+            knight_names = self.names(self.engine.state.team)
+            vote = await player.input_vote(f"Should {knight_names} go on a quest?")
+            return prompt.answer_vote(vote)
+        if prompt.phase is Phase.BETRAY:
+            return prompt.answer_vote(await player.input_vote(BETRAY))
+        if prompt.phase is Phase.NOMINATE:
+            how_many = self.bold(f"{self._num_to_word[prompt.count]} knights")
+            msg = f"Lord commander! Select {how_many} to go on this quest!"
+        elif prompt.phase is Phase.LADY:
+            msg = LADY
         else:
-            winner = Side.GOOD
-        await self.broadcast(self.quest_result(winner))
-        return winner
-
-    async def lady_of_the_lake(self) -> None:
-        target = self.next_lady_target
-        await self.broadcast(f"The lady of the Lake visits {target.name}")
-        (chosen,) = await self.input_players(
-            target,
-            "Whose allegiance would you like the Lady of the Lake to reveal?",
-            1,
-            self.lady_excludes,
-        )
-        (role,) = [role for player, role in self.player_map if player is chosen]
-        await target.send(self.lady_reveal(chosen.name, role.value.side))
-        await self.broadcast(
-            f"The Lady of the Lake revealed the allegiance of {chosen.name} to {target.name}"
-        )
-        self.set_next_lady_target(chosen)
-
-    async def last_ditch_assassination(self) -> bool:
-        def find_player(role: Role) -> Optional[Player]:
-            matches = [player for player, prole in self.player_map if prole is role]
-            if len(matches) == 1:
-                return matches[0]
-            return None
-
-        assassin = find_player(Role.Assassin)
-        merlin = find_player(Role.Merlin)
-        if not assassin or not merlin:
-            return False
-        await self.broadcast(
-            "The forces of evil have one last chance to win by murdering Merlin"
-        )
-        (murdered,) = await self.input_players(assassin, ASSASSINATE, 1, None)
-        merlin_dead = merlin is murdered
-        yes_or_no = "not " if not merlin_dead else ""
-        this_is_merlin = self.bold(f"This is {yes_or_no}Merlin!")
-        await self.broadcast(
-            f"The assassin has murdered {murdered.name}! {this_is_merlin}"
-        )
-        return merlin_dead
+            msg = ASSASSINATE
+        exclude = {self.players[seat].name for seat in prompt.exclude}
+        chosen = await self.input_players(player, msg, prompt.count, exclude)
+        return prompt.answer_seats(self.seating.seat(p.name) for p in chosen)
 
-    async def play(self) -> None:
-        await asyncio.gather(
-            *[self.send_initial_info(idx) for idx in range(len(self.player_map))]
-        )
-        if Flag.NoQuests in self.flags:
-            return
-        score: Dict[Side, int] = {s: 0 for s in Side}
-        for quest_idx, quest in enumerate(self.active_rules.quests):
-            winner = await self.quest(quest)
-            score[winner] += 1
-            await self.broadcast(
-                "Current score:\n"
-                + ("\n".join([self.bold(s.value + ": " + str(score[s])) for s in Side]))
+    def fallback(self, prompt: Prompt) -> Decision:
+        assert self.deadlines is not None
+        if prompt.phase is Phase.VOTE:
+            return prompt.answer_vote(self.deadlines.approve)
+        if prompt.phase is Phase.BETRAY:
+            return prompt.answer_vote(False)
+        if prompt.phase is Phase.LADY:
+            return prompt.answer_seats(())
+        seats = [
+            seat for seat in range(len(self.players)) if seat not in prompt.exclude
+        ]
+        return prompt.answer_seats(self.rng.sample(seats, prompt.count))
+
+    async def decide_in_time(self, prompt: Prompt) -> Decision:
+        assert self.deadlines is not None
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline = min(start + self.deadlines.decision, self.expires)
+        player = self.players[prompt.seat]
+        if deadline <= start:
+            await self.broadcast(f"{player.name} ran out of time")
+            return self.fallback(prompt)
+        task = asyncio.ensure_future(self.decide(prompt))
+        for warning in sorted(self.deadlines.warnings, reverse=True):
+            if deadline - warning <= loop.time():
+                continue
+            done, _ = await asyncio.wait(
+                {task}, timeout=deadline - warning - loop.time()
             )
-            (leading_team, nr_wins) = max(score.items(), key=lambda item: item[1])
-            if nr_wins > len(self.active_rules.quests) // 2:
-                break
-            if Flag.Lady in self.flags and quest_idx >= LADY_BEGINS_AFTER:
-                await self.lady_of_the_lake()
+            if done:
+                return task.result()
+            await player.send(f"You have {warning:g} seconds left to decide")
+        done, _ = await asyncio.wait({task}, timeout=max(0.0, deadline - loop.time()))
+        if done:
+            return task.result()
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+        await self.broadcast(f"{player.name} ran out of time")
+        return self.fallback(prompt)
+
+    async def timed_decide(
+        self, decide: Callable[[Prompt], Awaitable[Decision]], prompt: Prompt
+    ) -> Decision:
+        assert self.metrics is not None
+        start = time.perf_counter()
+        decision = await decide(prompt)
+        name = self.players[prompt.seat].name
+        self.metrics.decision(name, prompt.phase.value, time.perf_counter() - start)
+        return decision
+
+    def replay(self, decisions: List[Decision]) -> None:
+        self.engine.start()
+        for decision in decisions:
+            self.engine.apply(decision)
+        self.engine.drain()
+        self.started = True
+
+    async def play(self) -> None:
+        if self.started:
+            await self.broadcast("The kingdom has been restored!")
         else:
-            raise ValueError("no victory")
-        if leading_team is Side.GOOD:
-            if await self.last_ditch_assassination():
-                leading_team = Side.EVIL
-        await self.broadcast(self.victory(leading_team))
+            self.engine.start()
+            self.started = True
+            if self.checkpoint is not None:
+                await self.checkpoint.start(self)
+        metrics = self.metrics
+        decide: Callable[[Prompt], Awaitable[Decision]] = self.decide
+        if self.deadlines is not None:
+            decide = self.decide_in_time
+            if self.deadlines.budget is not None:
+                loop = asyncio.get_running_loop()
+                self.expires = loop.time() + self.deadlines.budget
+        if metrics is not None:
+            decide = functools.partial(self.timed_decide, decide)
+        while True:
+            start = time.perf_counter()
+            for event in self.engine.drain():
+                await self.announce(event)
+            await self.flush()
+            prompts = self.engine.pending_decisions()
+            if metrics is not None:
+                metrics.phase("announce", time.perf_counter() - start)
+            if not prompts:
+                break
+            start = time.perf_counter()
+            decisions = await asyncio.gather(*[decide(p) for p in prompts])
+            if metrics is not None:
+                metrics.phase(prompts[0].phase.value, time.perf_counter() - start)
+            for decision in decisions:
+                self.engine.apply(decision)
+            if self.checkpoint is not None:
+                await self.checkpoint.record(decisions)
+        if self.checkpoint is not None:
+            self.checkpoint.finish()
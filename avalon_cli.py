@@ -1,30 +1,303 @@
 #! /usr/bin/python3
 
+import argparse
 import asyncio
-import socket
-from typing import List, Set
+import collections
+import json
+import os
+import secrets
+import struct
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
 import avalon
+import avalon_log
+import avalon_metrics
+
+HIGH_WATER = 0x100000
+LOW_WATER = 0x40000
+REPLAY = 256
+VERSION = 2
+HELLO = f"AVALON/{VERSION} "
+FRAME = struct.Struct("<IB")
+MAX_FRAME = 0x100000
+MAX_LINE = 0x10000
+TEXT, VOTE, PLAYERS, STATE, REPLY, TOKEN, SYNC, QUIT = range(8)
+CONTROL = {TOKEN: b"T", SYNC: b"S", QUIT: b"Q"}
+
+
+class LineBuffer:
+    def __init__(self, size: int = 0x1000, limit: int = MAX_LINE):
+        self.buf = bytearray(size)
+        self.limit = limit
+        self.start = 0
+        self.end = 0
+        self.scan = 0
+
+    def reserve(self, n: int) -> None:
+        if len(self.buf) - self.end >= n:
+            return
+        live = self.end - self.start
+        if self.start:
+            with memoryview(self.buf) as view:
+                view[:live] = view[self.start : self.end]
+            self.scan -= self.start
+            self.start, self.end = 0, live
+        if len(self.buf) - self.end < n:
+            self.buf.extend(bytes(max(n, len(self.buf))))
+
+    def feed(self, data: bytes) -> None:
+        n = len(data)
+        self.reserve(n)
+        with memoryview(self.buf) as view:
+            view[self.end : self.end + n] = data
+        self.end += n
+
+    def lines(self) -> Iterator[str]:
+        while (idx := self.buf.find(b"\n", self.scan, self.end)) >= 0:
+            with memoryview(self.buf) as view:
+                line = str(view[self.start : idx], "utf-8", "replace")
+            self.start = self.scan = idx + 1
+            yield line
+        if self.start == self.end:
+            self.start = self.end = self.scan = 0
+        elif self.end - self.start > self.limit:
+            raise ConnectionError("line too long")
+        else:
+            self.scan = self.end
+
+    def frames(self) -> Iterator[Tuple[int, bytes]]:
+        while self.end - self.start >= FRAME.size:
+            size, kind = FRAME.unpack_from(self.buf, self.start)
+            if size > MAX_FRAME:
+                raise ConnectionError("frame too large")
+            stop = self.start + FRAME.size + size
+            if stop > self.end:
+                break
+            payload = bytes(self.buf[self.start + FRAME.size : stop])
+            self.start = self.scan = stop
+            yield kind, payload
+        if self.start == self.end:
+            self.start = self.end = self.scan = 0
+
+
+class LineReader:
+    def __init__(self, reader: asyncio.StreamReader, chunk: int = 0x1000):
+        self.reader = reader
+        self.chunk = chunk
+        self.buffer = LineBuffer(chunk)
+        self.pending: Deque[str] = collections.deque()
+        self.outstanding = 0
+
+    async def read(self) -> str:
+        while not self.pending:
+            data = await self.reader.read(self.chunk)
+            if not data:
+                raise ConnectionError("connection closed")
+            self.buffer.feed(data)
+            self.pending.extend(self.buffer.lines())
+        return self.pending.popleft().strip()
+
+    async def reply(self, ident: int) -> str:
+        self.outstanding += 1
+        while self.outstanding > 1:
+            await self.read()
+            self.outstanding -= 1
+        line = await self.read()
+        self.outstanding -= 1
+        return line
+
+    def at_eof(self) -> bool:
+        return not self.pending and self.reader.at_eof()
+
+
+class FrameReader:
+    def __init__(self, reader: asyncio.StreamReader, chunk: int = 0x1000):
+        self.reader = reader
+        self.chunk = chunk
+        self.buffer = LineBuffer(chunk)
+        self.pending: Deque[Tuple[int, bytes]] = collections.deque()
+
+    async def read(self) -> Tuple[int, bytes]:
+        while not self.pending:
+            data = await self.reader.read(self.chunk)
+            if not data:
+                raise ConnectionError("connection closed")
+            self.buffer.feed(data)
+            self.pending.extend(self.buffer.frames())
+        return self.pending.popleft()
+
+    async def reply(self, ident: int) -> str:
+        while True:
+            kind, payload = await self.read()
+            if kind != REPLY:
+                continue
+            try:
+                reply = json.loads(payload)
+            except ValueError:
+                continue
+            if isinstance(reply, dict) and reply.get("id") == ident:
+                return str(reply.get("answer", "")).strip()
+
+    def at_eof(self) -> bool:
+        return not self.pending and self.reader.at_eof()
+
+
+Reader = Union[LineReader, FrameReader]
+
+
+def encode(msg: str) -> bytes:
+    return b"".join(b"P" + line.encode() + b"\n" for line in msg.split("\n"))
+
+
+def frame(kind: int, payload: bytes) -> bytes:
+    return FRAME.pack(len(payload), kind) + payload
+
+
+def frame_json(kind: int, obj: Any) -> bytes:
+    return frame(kind, json.dumps(obj, separators=(",", ":")).encode())
+
+
+def encode_text(msg: str, framed: bool) -> bytes:
+    return frame(TEXT, msg.encode()) if framed else encode(msg)
+
+
+def encode_control(kind: int, value: str, framed: bool) -> bytes:
+    if framed:
+        return frame(kind, value.encode())
+    return CONTROL[kind] + value.encode() + b"\n"
+
+
+class Outbox:
+    def __init__(
+        self,
+        writer: asyncio.StreamWriter,
+        high: int = HIGH_WATER,
+        low: int = LOW_WATER,
+    ):
+        self.writer = writer
+        self.high = high
+        self.low = low
+        self.queue: Deque[bytes] = collections.deque()
+        self.size = 0
+        self.error: Optional[ConnectionError] = None
+        self.closed = False
+        self.ready = asyncio.Event()
+        self.drained = asyncio.Event()
+        self.drained.set()
+        self.task = asyncio.create_task(self.run())
+
+    def push(self, data: bytes) -> None:
+        self.queue.append(data)
+        self.size += len(data)
+        self.ready.set()
+
+    async def put(self, data: bytes) -> None:
+        if self.error is not None:
+            raise self.error
+        self.push(data)
+        if self.size > self.high:
+            self.drained.clear()
+            await self.drained.wait()
+            if self.error is not None:
+                raise self.error
+
+    def close(self) -> None:
+        self.closed = True
+        self.ready.set()
+
+    async def run(self) -> None:
+        try:
+            while self.queue or not self.closed:
+                await self.ready.wait()
+                self.ready.clear()
+                data = b"".join(self.queue)
+                self.queue.clear()
+                self.writer.write(data)
+                await self.writer.drain()
+                self.size -= len(data)
+                if self.size <= self.low:
+                    self.drained.set()
+        except ConnectionError as e:
+            self.error = e
+            self.drained.set()
+        finally:
+            self.writer.close()
 
 
 class CliPlayer(avalon.Player):
-    def __init__(self, c: socket.socket):
-        self.c = c
-        name = asyncio.get_event_loop().run_until_complete(self.read())
+    def __init__(
+        self,
+        name: str,
+        reader: Reader,
+        writer: asyncio.StreamWriter,
+        token: str = "",
+    ):
+        self.reader = reader
+        self.writer = writer
+        self.outbox = Outbox(writer)
+        self.token = token
+        self.roster: Sequence[str] = ()
+        self.history: Deque[str] = collections.deque(maxlen=REPLAY)
+        self.sent = 0
+        self.prompts = 0
+        self.online = asyncio.Event()
+        self.online.set()
         super().__init__(name)
 
-    async def read(self) -> str:
-        loop = asyncio.get_event_loop()
-        data = b""
-        while not data.endswith(b"\n"):
-            data += await loop.sock_recv(self.c, 0x1000)
-        return data.decode().strip()
-
-    async def input(self) -> str:
-        loop = asyncio.get_event_loop()
-        await loop.sock_sendall(self.c, b"I\n")
-        data = await self.read()
-        return data
+    @property
+    def framed(self) -> bool:
+        return isinstance(self.reader, FrameReader)
+
+    def resume(self, reader: Reader, writer: asyncio.StreamWriter, seen: int) -> None:
+        missed = min(max(self.sent - seen, 0), self.sent)
+        history = list(self.history)
+        replay = history[max(len(history) - missed, 0) :] if missed else []
+        self.outbox.close()
+        self.reader.reader.feed_eof()
+        self.reader, self.writer = reader, writer
+        self.outbox = Outbox(writer)
+        if missed > len(replay):
+            lost = f"[{missed - len(replay)} messages lost]"
+            self.outbox.push(encode_text(lost, self.framed))
+        if replay:
+            self.outbox.push(encode_text("\n".join(replay), self.framed))
+        self.outbox.push(encode_control(SYNC, str(self.sent), self.framed))
+        self.online.set()
+
+    async def write(self, data: bytes) -> None:
+        try:
+            await self.outbox.put(data)
+        except ConnectionError:
+            self.online.clear()
+
+    async def ask(self, kind: int, msg: str, fields: Dict[str, Any]) -> str:
+        self.prompts += 1
+        ident = self.prompts
+        if not self.framed:
+            await self.send(msg)
+        while True:
+            reader = self.reader
+            if isinstance(reader, FrameReader):
+                await self.write(frame_json(kind, dict(fields, id=ident, text=msg)))
+            else:
+                await self.write(b"I\n")
+            try:
+                return await reader.reply(ident)
+            except ConnectionError:
+                if reader is self.reader:
+                    self.online.clear()
+                await self.online.wait()
 
     async def input_players(
         self,
@@ -32,80 +305,479 @@ class CliPlayer(avalon.Player):
         count: int,
         exclude: Set[str],
     ) -> List[str]:
+        fields = {"roster": self.roster, "count": count, "exclude": sorted(exclude)}
         while True:
-            await self.send(msg)
-            reply = (await self.input()).split(" ")
-            if len(reply) == count:
-                return reply
+            names = (await self.ask(PLAYERS, msg, fields)).split()
+            roster = self.roster or names
+            error = avalon.selection_error(names, roster, count, exclude)
+            if error is None:
+                return names
+            await self.send(error)
 
     async def input_vote(self, msg: str) -> bool:
-        await self.send(msg)
-        return (await self.input()) == "+"
+        return (await self.ask(VOTE, msg, {})) == "+"
 
     async def send(self, msg: str) -> None:
-        loop = asyncio.get_event_loop()
         print(self.name, msg)
-        await loop.sock_sendall(self.c, b"P" + msg.encode() + b"\n")
+        lines = msg.split("\n")
+        self.history.extend(lines)
+        self.sent += len(lines)
+        await self.write(encode_text(msg, self.framed))
+
+    async def update(self, state: bytes) -> None:
+        if self.framed:
+            await self.write(state)
+
+    def close(self) -> None:
+        self.outbox.push(encode_control(QUIT, "", self.framed))
+        self.outbox.close()
+
+
+class CliGame(avalon.Game):
+    def snapshot(self) -> Dict[str, Any]:
+        state, names = self.engine.state, self.seating.names
+
+        def name(seat: int) -> Optional[str]:
+            return names[seat] if seat >= 0 else None
+
+        return {
+            "phase": state.phase.value,
+            "quest": state.quest,
+            "attempt": state.attempt,
+            "commander": name(state.commander),
+            "team": [names[seat] for seat in state.team],
+            "score": {side.value.lower(): n for side, n in state.score.items()},
+            "lady": name(state.lady),
+        }
+
+    async def flush(self) -> None:
+        await super().flush()
+        state = frame_json(STATE, self.snapshot())
+        for player in self.players:
+            if isinstance(player, CliPlayer):
+                await player.update(state)
 
 
 ADDRESS = ("127.0.0.1", 7015)
+BATCH = 0x1000
+DEADLINES = avalon.Deadlines(decision=300.0, warnings=(60.0, 10.0), budget=7200.0)
+NPLAYERS = 8
+RECONNECT_ATTEMPTS = 10
+RECONNECT_DELAY = 1.0
+RESUME = "!"
+SPECTATE = "?"
+SPECTATOR_QUEUE = 256
+VOTES = {"+": "+", "y": "+", "yes": "+", "-": "-", "n": "-", "no": "-"}
+ROLES = [
+    avalon.Role.Merlin,
+    avalon.Role.Mordred,
+    avalon.Role.Morgana,
+    avalon.Role.Percival,
+    avalon.Role.Oberon,
+]
 
 
-def server() -> None:
-    nplayers = 8
-    roles = [
-        avalon.Role.Merlin,
-        avalon.Role.Mordred,
-        avalon.Role.Morgana,
-        avalon.Role.Percival,
-        avalon.Role.Oberon,
-    ]
-
-    s = socket.socket()
-    s.bind(ADDRESS)
-    s.listen(nplayers)
-
-    print(f"Waiting for {nplayers} players")
-    players: List[avalon.Player] = []
-    while len(players) < nplayers:
-        c, _ = s.accept()
-        c.setblocking(False)
-        players.append(CliPlayer(c))
-    players.sort(key=lambda player: player.name)
-    asyncio.get_event_loop().run_until_complete(avalon.Game(players, roles).play())
-
-
-def client(name: str) -> None:
-    s = socket.socket()
-    s.connect(ADDRESS)
-    s.sendall(name.encode() + b"\n")
-    data = b""
-    while True:
-        s.setblocking(not data)
+class Spectator:
+    def __init__(self, writer: asyncio.StreamWriter, limit: int, framed: bool):
+        self.writer = writer
+        self.limit = limit
+        self.framed = framed
+        self.queue: Deque[bytes] = collections.deque()
+        self.dropped = 0
+        self.closed = False
+        self.ready = asyncio.Event()
+
+    def push(self, data: bytes) -> None:
+        if len(self.queue) >= self.limit:
+            self.queue.popleft()
+            self.dropped += 1
+        self.queue.append(data)
+        self.ready.set()
+
+    def close(self) -> None:
+        self.closed = True
+        self.ready.set()
+
+    async def run(self) -> None:
         try:
-            data += s.recv(0x100)
-        except BlockingIOError:
+            while self.queue or not self.closed:
+                await self.ready.wait()
+                self.ready.clear()
+                if self.dropped:
+                    skipped = f"[{self.dropped} messages skipped]"
+                    self.writer.write(encode_text(skipped, self.framed))
+                    self.dropped = 0
+                self.writer.write(b"".join(self.queue))
+                self.queue.clear()
+                await self.writer.drain()
+        except ConnectionError:
             pass
+        finally:
+            self.writer.close()
+
+
+class Gallery:
+    def __init__(self, limit: int = SPECTATOR_QUEUE):
+        self.limit = limit
+        self.spectators: Dict[Spectator, "asyncio.Task[None]"] = {}
+
+    def __len__(self) -> int:
+        return len(self.spectators)
+
+    def join(self, writer: asyncio.StreamWriter, framed: bool = False) -> Spectator:
+        spectator = Spectator(writer, self.limit, framed)
+        task = asyncio.create_task(spectator.run())
+        self.spectators[spectator] = task
+        task.add_done_callback(lambda _: self.spectators.pop(spectator, None))
+        return spectator
+
+    def publish(self, msg: str) -> None:
+        text, framed = encode(msg), frame(TEXT, msg.encode())
+        for spectator in self.spectators:
+            spectator.push(framed if spectator.framed else text)
+
+    def close(self) -> None:
+        for spectator in self.spectators:
+            spectator.close()
+
+
+class Server:
+    def __init__(
+        self,
+        nplayers: int = NPLAYERS,
+        roles: Optional[List[avalon.Role]] = None,
+        flags: Optional[Set[avalon.Flag]] = None,
+        metrics: Optional[avalon.Metrics] = None,
+        deadlines: Optional[avalon.Deadlines] = DEADLINES,
+        log: Optional[avalon_log.LogWriter] = None,
+    ):
+        self.nplayers = nplayers
+        self.roles = ROLES if roles is None else roles
+        self.flags = flags
+        self.metrics = metrics
+        self.deadlines = deadlines
+        self.log = log
+        self.lobby: List[CliPlayer] = []
+        self.tables: Set["asyncio.Task[None]"] = set()
+        self.galleries: Dict[int, Gallery] = {}
+        self.sessions: Dict[str, CliPlayer] = {}
+        self.next_table = 0
+
+    async def handle(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
         try:
-            idx = data.index(b"\n")
-        except ValueError:
-            continue
-        msg = data[:idx]
-        op = msg[0:1]
-        if op == b"P":
-            print(msg[1:].decode())
-        elif op == b"I":
-            s.sendall(input("> ").encode() + b"\n")
-        else:
-            print(msg.decode())
+            name = (await reader.readline()).decode().strip()
+        except (ConnectionError, ValueError):
+            name = ""
+        if not name:
+            writer.close()
+            return
+        framed = name.startswith(HELLO)
+        if framed:
+            name = name[len(HELLO) :]
+        lines: Reader = FrameReader(reader) if framed else LineReader(reader)
+        if name.startswith(SPECTATE):
+            self.spectate(name[len(SPECTATE) :], writer, framed)
+            return
+        if name.startswith(RESUME):
+            self.resume(name[len(RESUME) :], lines, writer)
+            return
+        for player in self.lobby:
+            if player.reader.at_eof():
+                del self.sessions[player.token]
+                player.outbox.close()
+        self.lobby = [player for player in self.lobby if not player.reader.at_eof()]
+        if any(player.name == name for player in self.lobby):
+            writer.write(encode_text(f"The name {name} is taken", framed))
+            writer.close()
+            return
+        token = secrets.token_hex(8)
+        player = CliPlayer(name, lines, writer, token)
+        player.outbox.push(encode_control(TOKEN, token, framed))
+        self.sessions[token] = player
+        self.lobby.append(player)
+        if len(self.lobby) >= self.nplayers:
+            players, self.lobby = (
+                self.lobby[: self.nplayers],
+                self.lobby[self.nplayers :],
+            )
+            self.seat(players)
+
+    def resume(self, session: str, lines: Reader, writer: asyncio.StreamWriter) -> None:
+        token, _, seen = session.partition(" ")
+        player = self.sessions.get(token)
+        if player is None or not seen.isdigit():
+            framed = isinstance(lines, FrameReader)
+            writer.write(
+                encode_text("Unknown session", framed)
+                + encode_control(QUIT, "", framed)
+            )
+            writer.close()
+            return
+        player.resume(lines, writer, int(seen))
+
+    def spectate(self, table: str, writer: asyncio.StreamWriter, framed: bool) -> None:
+        gallery = self.galleries.get(int(table)) if table.isdigit() else None
+        if gallery is None:
+            writer.write(encode_text(f"There is no table {table}", framed))
+            writer.close()
+            return
+        spectator = gallery.join(writer, framed)
+        spectator.push(encode_text(f"Watching table {table}", framed))
+
+    def seat(self, players: List[CliPlayer]) -> None:
+        players.sort(key=lambda player: player.name)
+        table_id = self.next_table
+        self.next_table += 1
+        self.galleries[table_id] = Gallery()
+        task = asyncio.create_task(self.run_table(table_id, players))
+        self.tables.add(task)
+        task.add_done_callback(self.tables.discard)
+
+    async def run_table(self, table_id: int, players: List[CliPlayer]) -> None:
+        print(f"Table {table_id}: {' '.join(player.name for player in players)}")
+        game_players: List[avalon.Player] = [player for player in players]
+        gallery = self.galleries[table_id]
+        try:
+            game = CliGame(
+                game_players,
+                self.roles,
+                self.flags,
+                batch=BATCH,
+                recorder=self.log.recorder() if self.log is not None else None,
+                metrics=self.metrics,
+                deadlines=self.deadlines,
+                watch=gallery.publish,
+            )
+            for player in players:
+                player.roster = game.seating.names
+            await game.play()
+        except ConnectionError:
+            print(f"Table {table_id}: a player has disconnected")
+        finally:
+            for player in players:
+                player.close()
+                del self.sessions[player.token]
+            gallery.close()
+            del self.galleries[table_id]
+
+    async def serve(self, address: Tuple[str, int] = ADDRESS) -> None:
+        server = await asyncio.start_server(self.handle, *address)
+        print(f"Waiting for {self.nplayers} players")
+        async with server:
+            await server.serve_forever()
+
+
+async def serve_metrics(
+    registry: avalon_metrics.Registry, address: Tuple[str, int]
+) -> None:
+    try:
+        await avalon_metrics.serve(registry, address)
+    except OSError as e:
+        print(f"Metrics endpoint disabled: {e}")
+
+
+async def run_server(
+    metrics: Optional[Tuple[str, int]] = None,
+    log: Optional[avalon_log.LogWriter] = None,
+) -> None:
+    if metrics is None:
+        await Server(log=log).serve()
+        return
+    registry = avalon_metrics.Registry()
+    await asyncio.gather(
+        Server(metrics=registry, log=log).serve(), serve_metrics(registry, metrics)
+    )
+
+
+def server(argv: Sequence[str] = ()) -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--metrics", type=int, metavar="PORT")
+    parser.add_argument("--log", metavar="PATH")
+    args = parser.parse_args(argv)
+    metrics = None
+    if args.metrics is not None:
+        metrics = (avalon_metrics.ADDRESS[0], args.metrics)
+    log = avalon_log.LogWriter(args.log) if args.log is not None else None
+    try:
+        asyncio.run(run_server(metrics, log))
+    finally:
+        if log is not None:
+            log.close()
+
+
+class StdinReader:
+    def __init__(self, fd: int = 0, chunk: int = 0x1000):
+        self.fd = fd
+        self.chunk = chunk
+        self.buffer = LineBuffer(chunk)
+        self.pending: Deque[str] = collections.deque()
+        self.pollable = True
+        self.blocking: Optional["asyncio.Future[bytes]"] = None
+
+    async def fill(self) -> bytes:
+        loop = asyncio.get_running_loop()
+        if self.pollable:
+            ready: "asyncio.Future[None]" = loop.create_future()
+            try:
+                loop.add_reader(self.fd, ready.set_result, None)
+            except PermissionError:
+                self.pollable = False
+            else:
+                try:
+                    await ready
+                finally:
+                    loop.remove_reader(self.fd)
+                return os.read(self.fd, self.chunk)
+        if self.blocking is None:
+            self.blocking = loop.run_in_executor(None, os.read, self.fd, self.chunk)
+        data = await asyncio.shield(self.blocking)
+        self.blocking = None
+        return data
+
+    async def read(self) -> str:
+        while not self.pending:
+            data = await self.fill()
+            if not data:
+                raise EOFError
+            self.buffer.feed(data)
+            self.pending.extend(self.buffer.lines())
+        return self.pending.popleft()
+
+
+def complete(word: str, names: Sequence[str]) -> str:
+    if word in names:
+        return word
+    matches = [name for name in names if name.lower().startswith(word.lower())]
+    return matches[0] if len(matches) == 1 else word
+
+
+async def answer(kind: int, prompt: Dict[str, Any], stdin: StdinReader) -> str:
+    print(prompt["text"])
+    if kind == VOTE:
+        while True:
+            print("> ", end="", flush=True)
+            reply = VOTES.get((await stdin.read()).strip().lower())
+            if reply is not None:
+                return reply
+            print("Answer + or -")
+    roster, count = prompt["roster"], prompt["count"]
+    exclude = set(prompt["exclude"])
+    allowed = [name for name in roster if name not in exclude]
+    names = allowed if len(allowed) >= count else roster
+    print(f"Choose {count} of: {' '.join(names)}")
+    while True:
+        print("> ", end="", flush=True)
+        words = (await stdin.read()).split()
+        chosen = [complete(word, names) for word in words]
+        error = avalon.selection_error(chosen, roster, count, exclude)
+        if error is None:
+            return " ".join(chosen)
+        print(error)
+
+
+class Session:
+    def __init__(self, name: str):
+        self.name = name
+        self.token = ""
+        self.seen = 0
+        self.state: Dict[str, Any] = {}
+        self.done = False
+
+    def hello(self) -> bytes:
+        if self.token:
+            return f"{HELLO}{RESUME}{self.token} {self.seen}\n".encode()
+        return f"{HELLO}{self.name}\n".encode()
+
+
+async def converse(
+    session: Session, address: Tuple[str, int], stdin: StdinReader
+) -> None:
+    reader, writer = await asyncio.open_connection(*address)
+    writer.write(session.hello())
+    frames = FrameReader(reader)
+    reading: Optional["asyncio.Task[Tuple[int, bytes]]"] = None
+    answering: Optional["asyncio.Task[str]"] = None
+    ident = 0
+    try:
+        while True:
+            if reading is None:
+                reading = asyncio.create_task(frames.read())
+            waiting: Set["asyncio.Future[Any]"] = {reading}
+            if answering is not None:
+                waiting.add(answering)
+            await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            if answering is not None and answering.done():
+                try:
+                    reply = answering.result()
+                except EOFError:
+                    session.done = True
+                    return
+                answering = None
+                writer.write(frame_json(REPLY, {"id": ident, "answer": reply}))
+                await writer.drain()
+            if not reading.done():
+                continue
+            try:
+                kind, payload = reading.result()
+            except ConnectionError:
+                return
+            reading = None
+            if kind == TEXT:
+                text = payload.decode()
+                session.seen += text.count("\n") + 1
+                print(text)
+            elif kind in (VOTE, PLAYERS):
+                if answering is not None:
+                    answering.cancel()
+                prompt = json.loads(payload)
+                ident = prompt["id"]
+                answering = asyncio.create_task(answer(kind, prompt, stdin))
+            elif kind == STATE:
+                session.state = json.loads(payload)
+            elif kind == TOKEN:
+                session.token = payload.decode()
+            elif kind == SYNC:
+                session.seen = int(payload)
+            elif kind == QUIT:
+                session.done = True
+                return
+    finally:
+        for task in (reading, answering):
+            if task is not None:
+                task.cancel()
+        writer.close()
+
+
+async def run_client(name: str, address: Tuple[str, int]) -> None:
+    session = Session(name)
+    stdin = StdinReader()
+    failures = 0
+    while True:
+        try:
+            await converse(session, address, stdin)
+            failures = 0
+        except OSError:
+            failures += 1
+        if session.done or not session.token or failures > RECONNECT_ATTEMPTS:
+            break
+        print("Connection lost, reconnecting")
+        await asyncio.sleep(RECONNECT_DELAY)
+
 
-        data = data[idx + 1 :]
+def client(name: str, address: Tuple[str, int] = ADDRESS) -> None:
+    asyncio.run(run_client(name, address))
 
 
 if __name__ == "__main__":
     import sys
 
-    if len(sys.argv) == 1:
-        server()
+    if len(sys.argv) == 1 or sys.argv[1].startswith("--") and sys.argv[1] != "--watch":
+        server(sys.argv[1:])
+    elif sys.argv[1] == "--watch":
+        client(SPECTATE + sys.argv[2])
     else:
-        client(*sys.argv[1:])
+        client(sys.argv[1])
@@ -2,50 +2,385 @@
 
 import argparse
 import asyncio
+import collections
+import dataclasses
 import enum
+import itertools
 import os
+import time
 import traceback
-from typing import Any, Awaitable, Dict, List, Optional, Set, Union
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 import discord
 import dotenv
 
 import avalon
+import avalon_log
 
 Member = Union[discord.User, discord.Member]
 
+MESSAGE_LIMIT = 2000
 
+T = TypeVar("T")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+
+    def wait(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+@dataclasses.dataclass
+class Outgoing:
+    send: Callable[[], Awaitable[Any]]
+    future: "asyncio.Future[Any]"
+    queued: float
+
+
+class SendScheduler:
+    def __init__(
+        self,
+        rate: float = 50.0,
+        burst: int = 50,
+        route_rate: float = 1.0,
+        route_burst: int = 5,
+        concurrency: int = 8,
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.route_rate = route_rate
+        self.route_burst = route_burst
+        self.routes: Dict[Hashable, TokenBucket] = {}
+        self.concurrency = concurrency
+        self.inflight: Set[Hashable] = set()
+        self.queues: Dict[Hashable, Dict[Hashable, Deque[Outgoing]]] = {}
+        self.order: Deque[Hashable] = collections.deque()
+        self.wakeup = asyncio.Event()
+        self.task: Optional["asyncio.Task[None]"] = None
+        self.sent = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def send(
+        self,
+        table: Hashable,
+        route: Hashable,
+        send: Callable[[], Awaitable[T]],
+    ) -> T:
+        future: "asyncio.Future[T]" = asyncio.get_running_loop().create_future()
+        if table not in self.queues:
+            self.queues[table] = {}
+            self.order.append(table)
+        queue = self.queues[table].setdefault(route, collections.deque())
+        queue.append(Outgoing(send, future, time.monotonic()))
+        self.wakeup.set()
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        return await future
+
+    def depth(self, table: Optional[Hashable] = None) -> int:
+        if table is not None:
+            return sum(len(queue) for queue in self.queues.get(table, {}).values())
+        return sum(self.depth(table) for table in self.queues)
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "queued": self.depth(),
+            "inflight": len(self.inflight),
+            "sent": self.sent,
+            "wait_avg": self.wait_total / self.sent if self.sent else 0.0,
+            "wait_max": self.wait_max,
+        }
+
+    async def run(self) -> None:
+        while True:
+            self.wakeup.clear()
+            delay = self.dispatch()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def dispatch(self) -> Optional[float]:
+        delay: Optional[float] = None
+        while len(self.inflight) < self.concurrency:
+            for _ in range(len(self.order)):
+                if not self.order:
+                    return delay
+                table = self.order[0]
+                self.order.rotate(-1)
+                wait = self.pick(table)
+                if wait == 0:
+                    break
+                if wait is not None and (delay is None or wait < delay):
+                    delay = wait
+            else:
+                return delay
+        return None
+
+    def pick(self, table: Hashable) -> Optional[float]:
+        routes = self.queues[table]
+        delay: Optional[float] = None
+        for route, queue in list(routes.items()):
+            while queue and queue[0].future.done():
+                queue.popleft()
+            if not queue:
+                self.rotate(table, route)
+                continue
+            if route in self.inflight:
+                continue
+            bucket = self.routes.get(route)
+            if bucket is None:
+                bucket = self.routes[route] = TokenBucket(
+                    self.route_rate, self.route_burst
+                )
+            wait = max(self.bucket.wait(), bucket.wait())
+            if wait > 0:
+                if delay is None or wait < delay:
+                    delay = wait
+                continue
+            self.bucket.take()
+            bucket.take()
+            item = queue.popleft()
+            self.rotate(table, route)
+            self.inflight.add(route)
+            asyncio.create_task(self.deliver(route, item))
+            return 0
+        return delay
+
+    def rotate(self, table: Hashable, route: Hashable) -> None:
+        routes = self.queues[table]
+        queue = routes.pop(route)
+        if queue:
+            routes[route] = queue
+        elif not routes:
+            del self.queues[table]
+            self.order.remove(table)
+
+    async def deliver(self, route: Hashable, item: Outgoing) -> None:
+        wait = time.monotonic() - item.queued
+        self.sent += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        try:
+            result = await item.send()
+            if not item.future.done():
+                item.future.set_result(result)
+        except Exception as e:
+            if not item.future.done():
+                item.future.set_exception(e)
+        finally:
+            self.inflight.discard(route)
+            self.wakeup.set()
+
+
+class Table:
+    def __init__(self, guild: int, channel: int, id: int):
+        self.guild = guild
+        self.channel = channel
+        self.id = id
+        self.tokens = itertools.count(time.time_ns() // 1_000_000)
+        self.waiters: Dict[int, Tuple[str, "asyncio.Future[discord.Interaction]"]] = {}
+        self.task: Optional["asyncio.Task[None]"] = None
+
+    def open_prompt(
+        self, player: str
+    ) -> Tuple[int, "asyncio.Future[discord.Interaction]"]:
+        token = next(self.tokens)
+        fut: "asyncio.Future[discord.Interaction]" = asyncio.Future()
+        self.waiters[token] = (player, fut)
+        fut.add_done_callback(lambda _: self.waiters.pop(token, None))
+        return token, fut
+
+    def custom_id(self, token: int, value: str) -> str:
+        return f"{self.id}:{token}:{value}"
+
+    @staticmethod
+    def parse_custom_id(custom_id: str) -> Optional[Tuple[int, int, str]]:
+        try:
+            table, token, value = custom_id.split(":", 2)
+            return int(table), int(token), value
+        except ValueError:
+            return None
+
+    def resolve(
+        self, token: int, player: str, interaction: discord.Interaction
+    ) -> bool:
+        waiter = self.waiters.get(token)
+        if waiter is None or waiter[0] != player:
+            return False
+        del self.waiters[token]
+        if waiter[1].done():
+            return False
+        waiter[1].set_result(interaction)
+        return True
+
+    def close(self) -> None:
+        for _, fut in self.waiters.values():
+            fut.cancel()
+        self.waiters.clear()
+
+
+@dataclasses.dataclass(frozen=True)
 class NominationOption:
-    def __init__(self, player: avalon.Player):
+    mention: str
+    label: str
+
+    @classmethod
+    def of(cls, player: avalon.Player) -> "NominationOption":
         assert isinstance(player, DiscordPlayer)
         assert isinstance(player.member, discord.Member)
-        self.nick = player.member.nick
-        self.name = player.member.name
-        self.mention = player.client.to_mention(player.member)
+        names: List[str] = []
+        if player.member.nick is not None:
+            names.append(player.member.nick)
+        names.append(player.member.name)
+        return cls(player.client.to_mention(player.member), " / ".join(names))
+
+
+class NominationView(discord.ui.View):
+    def __init__(self, options: List[NominationOption]):
+        super().__init__(timeout=None)
+        self.buttons = {
+            opt.mention: discord.ui.Button["NominationView"](label=opt.label)
+            for opt in options
+        }
+
+    def reset(self, exclude: Set[str]) -> None:
+        self.clear_items()
+        for mention, button in self.buttons.items():
+            if mention not in exclude:
+                self.add_item(button)
+
+    def update(self, table: Table, token: int, chosen: List[str], count: int) -> None:
+        for mention, button in self.buttons.items():
+            button.custom_id = table.custom_id(token, mention)
+            if mention in chosen:
+                button.style = discord.ButtonStyle.success
+                button.disabled = True
+            elif len(chosen) < count:
+                button.style = discord.ButtonStyle.primary
+                button.disabled = False
+            else:
+                button.style = discord.ButtonStyle.secondary
+                button.disabled = True
+
+
+class Vote(enum.Enum):
+    YES = "yes"
+    NO = "no"
+
+
+class VoteView(discord.ui.View):
+    def __init__(self) -> None:
+        super().__init__(timeout=None)
+        self.buttons = {
+            item: discord.ui.Button["VoteView"](label=item.value) for item in Vote
+        }
+        for button in self.buttons.values():
+            self.add_item(button)
+
+    def update(
+        self,
+        table: Table,
+        token: int,
+        disabled: bool,
+        success: Optional[Vote],
+    ) -> None:
+        for item, button in self.buttons.items():
+            button.custom_id = table.custom_id(token, item.value)
+            button.disabled = disabled
+            if item is success:
+                button.style = discord.ButtonStyle.success
+            elif disabled:
+                button.style = discord.ButtonStyle.secondary
+            else:
+                button.style = discord.ButtonStyle.primary
+
+
+def forget_views(client: discord.Client, message_id: int) -> None:
+    state = getattr(client, "_connection", None)
+    store = getattr(state, "_view_store", None)
+    for name in ("_views", "_synced_message_views"):
+        views = getattr(store, name, None)
+        if isinstance(views, dict):
+            views.pop(message_id, None)
 
 
 class DiscordPlayer(avalon.Player):
-    def __init__(self, member: Member, client: "Client"):
+    def __init__(self, member: Member, client: "Client", table: Table):
         self.member = member
-        self.options: List[NominationOption] = []
+        self.nomination_view: Optional[NominationView] = None
+        self.vote_view: Optional[VoteView] = None
         self.client = client
+        self.table = table
         super().__init__(self.client.to_mention(member))
 
+    async def post(
+        self,
+        content: str,
+        view: Optional[discord.ui.View] = None,
+    ) -> discord.Message:
+        async def send() -> discord.Message:
+            if view is None:
+                return await self.member.send(content=content)
+            return await self.member.send(content=content, view=view)
+
+        return await self.client.scheduler.send(self.table.id, self.member.id, send)
+
     def set_options(self, options: List[NominationOption]) -> None:
-        self.options = options
+        self.nomination_view = NominationView(options)
+        self.vote_view = VoteView()
 
-    async def interact(self, aw: Awaitable[Any]) -> discord.Interaction:
-        fut: asyncio.Future[discord.Interaction] = asyncio.Future()
-        self.client.waiters[self.name] = fut
+    def close(self) -> None:
+        for view in (self.nomination_view, self.vote_view):
+            if view is not None:
+                view.stop()
+
+    def forget(self, posted: "asyncio.Future[discord.Message]") -> None:
+        if not posted.done():
+            posted.add_done_callback(self.forget)
+        elif not posted.cancelled() and posted.exception() is None:
+            forget_views(self.client, posted.result().id)
+
+    @staticmethod
+    async def interact(
+        aw: Awaitable[Any],
+        fut: "asyncio.Future[discord.Interaction]",
+    ) -> discord.Interaction:
         await asyncio.gather(aw, fut)
         return fut.result()
 
     @staticmethod
     def button_data(interaction: discord.Interaction) -> str:
         assert interaction.data
-        ret = interaction.data.get("custom_id")
-        assert isinstance(ret, str)
-        return ret
+        custom_id = interaction.data.get("custom_id")
+        assert isinstance(custom_id, str)
+        parsed = Table.parse_custom_id(custom_id)
+        assert parsed is not None
+        return parsed[2]
 
     async def input_players(
         self,
@@ -53,76 +388,44 @@ class DiscordPlayer(avalon.Player):
         count: int,
         exclude: Set[str],
     ) -> List[str]:
-        def view(chosen: List[str]) -> discord.ui.View:
-            v = discord.ui.View()
-            for opt in self.options:
-                if opt.mention in exclude:
-                    continue
-                if opt.mention in chosen:
-                    style = discord.ButtonStyle.success
-                    disabled = True
-                elif len(chosen) < count:
-                    style = discord.ButtonStyle.primary
-                    disabled = False
-                else:
-                    style = discord.ButtonStyle.secondary
-                    disabled = True
-                names: List[str] = []
-                if opt.nick is not None:
-                    names.append(opt.nick)
-                names.append(opt.name)
-                v.add_item(
-                    discord.ui.Button(
-                        label=" / ".join(names),
-                        custom_id=opt.mention,
-                        disabled=disabled,
-                        style=style,
-                    )
-                )
-            return v
-
+        view = self.nomination_view
+        assert view is not None
+        view.reset(exclude)
         chosen: List[str] = []
-        aw: Awaitable[Any] = self.member.send(content=content, view=view(chosen))
-        for _ in range(count):
-            interaction = await self.interact(aw)
-            chosen.append(self.button_data(interaction))
-            aw = interaction.response.edit_message(content=content, view=view(chosen))
-        await aw
+        token, fut = self.table.open_prompt(self.name)
+        view.update(self.table, token, chosen, count)
+        posted = asyncio.ensure_future(self.post(content, view))
+        aw: Awaitable[Any] = posted
+        try:
+            for _ in range(count):
+                interaction = await self.interact(aw, fut)
+                chosen.append(self.button_data(interaction))
+                if len(chosen) < count:
+                    token, fut = self.table.open_prompt(self.name)
+                view.update(self.table, token, chosen, count)
+                aw = interaction.response.edit_message(content=content, view=view)
+            await aw
+        finally:
+            self.forget(posted)
         return chosen
 
     async def input_vote(self, content: str) -> bool:
-        class Vote(enum.Enum):
-            YES = "yes"
-            NO = "no"
-
-        def view(disabled: bool, success: Optional[Vote]) -> discord.ui.View:
-            v = discord.ui.View()
-            for item in Vote:
-                if item is success:
-                    style = discord.ButtonStyle.success
-                elif disabled:
-                    style = discord.ButtonStyle.secondary
-                else:
-                    style = discord.ButtonStyle.primary
-                v.add_item(
-                    discord.ui.Button(
-                        label=item.value,
-                        custom_id=item.value,
-                        disabled=disabled,
-                        style=style,
-                    )
-                )
-            return v
-
-        interaction = await self.interact(
-            self.member.send(content=content, view=view(False, None))
-        )
-        reply = Vote(self.button_data(interaction))
-        await interaction.response.edit_message(content=content, view=view(True, reply))
-        return Vote(reply) is Vote.YES
+        view = self.vote_view
+        assert view is not None
+        token, fut = self.table.open_prompt(self.name)
+        view.update(self.table, token, False, None)
+        posted = asyncio.ensure_future(self.post(content, view))
+        try:
+            interaction = await self.interact(posted, fut)
+            reply = Vote(self.button_data(interaction))
+            view.update(self.table, token, True, reply)
+            await interaction.response.edit_message(content=content, view=view)
+        finally:
+            self.forget(posted)
+        return reply is Vote.YES
 
     async def send(self, msg: str) -> None:
-        await self.member.send(msg)
+        await self.post(msg)
 
 
 class DiscordGame(avalon.Game):
@@ -132,7 +435,13 @@ class DiscordGame(avalon.Game):
 
 
 class Client(discord.Client):
-    def __init__(self, summon: str) -> None:
+    def __init__(
+        self,
+        summon: str,
+        checkpoints: Optional[str] = None,
+        deadlines: Optional[avalon.Deadlines] = None,
+        log: Optional[avalon_log.LogWriter] = None,
+    ) -> None:
         super().__init__(
             intents=discord.Intents(
                 messages=True,
@@ -141,7 +450,14 @@ class Client(discord.Client):
             ),
         )
         self.summon = f"!{summon} "
-        self.waiters: Dict[str, "asyncio.Future[discord.Interaction]"] = {}
+        self.tables: Dict[int, Table] = {}
+        self.scheduler = SendScheduler()
+        self.checkpoints = checkpoints
+        self.deadlines = deadlines
+        self.log = log
+        self.restored = False
+        if checkpoints is not None:
+            os.makedirs(checkpoints, exist_ok=True)
 
     @staticmethod
     def to_mention(member: Member) -> str:
@@ -175,12 +491,13 @@ class Client(discord.Client):
         if content.startswith(self.summon):
             print(f"Summon message on channel {message.channel.name}")
             print(f"Content: {content}")
+            table = Table(message.channel.guild.id, message.channel.id, message.id)
             players: List[avalon.Player] = []
             roles = []
             flags: Set[avalon.Flag] = set()
             for part in content.split()[1:]:
                 if (member := self.get_member(part, message.mentions)) is not None:
-                    players.append(DiscordPlayer(member, self))
+                    players.append(DiscordPlayer(member, self, table))
                     continue
                 if (role := self.get_role(part)) is not None:
                     roles.append(role)
@@ -192,26 +509,142 @@ class Client(discord.Client):
                     f"Sorry, don't know what to do with `{part}`"
                 )
                 return
-            options = [NominationOption(player) for player in players]
+            checkpoint = self.checkpoint(table, players)
+            recorder = self.log.recorder() if self.log is not None else None
+            self.launch(
+                table,
+                players,
+                lambda: DiscordGame(
+                    players,
+                    roles,
+                    flags,
+                    batch=MESSAGE_LIMIT,
+                    checkpoint=checkpoint,
+                    recorder=recorder,
+                    deadlines=self.deadlines,
+                ),
+                message.channel,
+            )
+
+    def checkpoint(
+        self, table: Table, players: List[avalon.Player]
+    ) -> Optional[avalon.Checkpoint]:
+        if self.checkpoints is None:
+            return None
+        meta = {
+            "guild": table.guild,
+            "channel": table.channel,
+            "table": table.id,
+            "members": [
+                player.member.id
+                for player in players
+                if isinstance(player, DiscordPlayer)
+            ],
+        }
+        path = os.path.join(self.checkpoints, f"{table.id}.jsonl")
+        return avalon.Checkpoint(path, meta)
+
+    def launch(
+        self,
+        table: Table,
+        players: List[avalon.Player],
+        make_game: Callable[[], DiscordGame],
+        channel: discord.TextChannel,
+    ) -> None:
+        options = [NominationOption.of(player) for player in players]
+        for player in players:
+            assert isinstance(player, DiscordPlayer)
+            player.set_options(options)
+        self.tables[table.id] = table
+        table.task = asyncio.create_task(
+            self.run_table(table, players, make_game, channel)
+        )
+
+    async def run_table(
+        self,
+        table: Table,
+        players: List[avalon.Player],
+        make_game: Callable[[], DiscordGame],
+        channel: discord.TextChannel,
+    ) -> None:
+        game: Optional[DiscordGame] = None
+        try:
+            game = make_game()
+            await game.play()
+        except Exception:
+            if game is not None and game.checkpoint is not None:
+                game.checkpoint.finish()
+            tb = traceback.format_exc()
+            await channel.send(f"The kingdom has fallen!\n```{tb}```")
+        finally:
+            self.tables.pop(table.id, None)
+            table.close()
             for player in players:
                 assert isinstance(player, DiscordPlayer)
-                player.set_options(options)
+                player.close()
+
+    async def resume(self, path: str) -> None:
+        snapshot = avalon.Checkpoint.load(path)
+        meta = snapshot.meta
+        guild = self.get_guild(meta["guild"])
+        channel = guild.get_channel(meta["channel"]) if guild is not None else None
+        if guild is None or not isinstance(channel, discord.TextChannel):
+            print(f"Cannot resume {path}: channel is gone")
+            return
+        table = Table(guild.id, channel.id, meta["table"])
+        players: List[avalon.Player] = []
+        for member_id in meta["members"]:
             try:
-                await DiscordGame(players, roles, flags).play()
-            except Exception:
-                tb = traceback.format_exc()
-                await message.channel.send(f"The kingdom has fallen!\n```{tb}```")
+                member = await guild.fetch_member(member_id)
+            except discord.HTTPException:
+                print(f"Cannot resume {path}: member {member_id} is gone")
+                return
+            players.append(DiscordPlayer(member, self, table))
+
+        def make_game() -> DiscordGame:
+            game = DiscordGame(
+                players,
+                [],
+                snapshot.flags,
+                snapshot.rules,
+                batch=MESSAGE_LIMIT,
+                checkpoint=avalon.Checkpoint(path, meta),
+                deal=snapshot.roles,
+                deadlines=self.deadlines,
+            )
+            game.replay(snapshot.decisions)
+            return game
+
+        print(f"Resuming game {table.id} on channel {channel.name}")
+        self.launch(table, players, make_game, channel)
 
     async def on_interaction(self, interaction: discord.Interaction) -> None:
-        waiter = self.waiters.pop(self.to_mention(interaction.user), None)
-        if waiter is not None:
-            waiter.set_result(interaction)
+        if interaction.data is None:
+            return
+        custom_id = interaction.data.get("custom_id")
+        if not isinstance(custom_id, str):
+            return
+        parsed = Table.parse_custom_id(custom_id)
+        if parsed is not None:
+            table_id, token, _ = parsed
+            table = self.tables.get(table_id)
+            player = self.to_mention(interaction.user)
+            if table is not None and table.resolve(token, player, interaction):
+                return
+        await interaction.response.send_message(
+            "This prompt is no longer active", ephemeral=True
+        )
 
     async def on_ready(
         self,
     ) -> None:
         assert self.user is not None
         print(f"{self.user.name} has connected to Discord!")
+        if self.checkpoints is not None and not self.restored:
+            self.restored = True
+            for entry in sorted(os.listdir(self.checkpoints)):
+                if entry.endswith(".jsonl"):
+                    await self.resume(os.path.join(self.checkpoints, entry))
 
 
 async def main() -> None:
@@ -219,9 +652,21 @@ async def main() -> None:
     token = os.getenv("DISCORD_TOKEN_AVALON")
     parser = argparse.ArgumentParser()
     parser.add_argument("--summon", type=str, default="avalon")
+    parser.add_argument("--checkpoints", type=str, default=None)
+    parser.add_argument("--timeout", type=float, default=None)
+    parser.add_argument("--budget", type=float, default=None)
+    parser.add_argument("--log", type=str, default=None)
     args = parser.parse_args()
     assert token is not None
-    await Client(args.summon).start(token)
+    deadlines = None
+    if args.timeout is not None:
+        deadlines = avalon.Deadlines(args.timeout, budget=args.budget)
+    log = avalon_log.LogWriter(args.log) if args.log is not None else None
+    try:
+        await Client(args.summon, args.checkpoints, deadlines, log).start(token)
+    finally:
+        if log is not None:
+            log.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,304 @@
+#! /usr/bin/python3
+
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+import avalon
+
+ROLES = list(avalon.Role)
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+PHASES = list(avalon.Phase)
+NOMINATE, VOTE, BETRAY, LADY, ASSASSINATE, DONE = (
+    PHASES.index(phase) for phase in avalon.Phase
+)
+EVIL_CODES = np.array([role.value.side is avalon.Side.EVIL for role in ROLES])
+SEES = np.array(
+    [
+        [bool(avalon.KNOWS[role] & avalon.ROLE_BITS[other]) for other in ROLES]
+        for role in ROLES
+    ]
+)
+MERLIN = ROLE_CODES[avalon.Role.Merlin]
+ASSASSIN = ROLE_CODES[avalon.Role.Assassin]
+GOOD, EVIL = 0, 1
+
+Array = npt.NDArray[np.int64]
+Mask = npt.NDArray[np.bool_]
+Actions = Tuple[Array, Mask, Mask, Array]
+
+
+class VecEnv:
+    def __init__(
+        self,
+        num_envs: int,
+        nplayers: int,
+        roles: Optional[List[avalon.Role]] = None,
+        flags: Optional[Set[avalon.Flag]] = None,
+        rules: Optional[avalon.Rules] = None,
+        seed: int = 0,
+    ):
+        self.num_envs = num_envs
+        self.nplayers = nplayers
+        self.rules = rules or avalon._default_rules[nplayers]
+        self.lady_enabled = avalon.Flag.Lady in (flags or set())
+        deal = avalon.deal_roles(nplayers, roles or [], self.rules, random.Random(seed))
+        self.deal = np.array(sorted(ROLE_CODES[role] for role in deal), dtype=np.int8)
+        self.assassination = deal.count(avalon.Role.Merlin) == 1 and (
+            deal.count(avalon.Role.Assassin) == 1
+        )
+        self.team_sizes = np.array([q.num_players for q in self.rules.quests])
+        self.required_fails = np.array([q.required_fails for q in self.rules.quests])
+        self.wins = len(self.rules.quests) // 2 + 1
+        self.rng = np.random.default_rng(seed)
+        self.seats = np.arange(nplayers)
+        self.bits = 1 << self.seats
+        n, p = num_envs, nplayers
+        self.roles = np.zeros((n, p), dtype=np.int8)
+        self.evil = np.zeros((n, p), dtype=bool)
+        self.known = np.zeros((n, p, p), dtype=bool)
+        self.lady_seen = np.zeros((n, p, p), dtype=np.int8)
+        self.phase = np.zeros(n, dtype=np.int64)
+        self.quest = np.zeros(n, dtype=np.int64)
+        self.attempt = np.zeros(n, dtype=np.int64)
+        self.commander = np.zeros(n, dtype=np.int64)
+        self.team = np.zeros(n, dtype=np.int64)
+        self.votes = np.zeros((n, p), dtype=np.int8)
+        self.betrayals = np.zeros(n, dtype=np.int64)
+        self.score = np.zeros((n, 2), dtype=np.int64)
+        self.lady = np.zeros(n, dtype=np.int64)
+        self.lady_excludes = np.zeros(n, dtype=np.int64)
+        self.winner = np.full(n, -1, dtype=np.int64)
+
+    def deal_into(self, idx: Array) -> None:
+        p = self.nplayers
+        roles = self.rng.permuted(np.broadcast_to(self.deal, (len(idx), p)), axis=1)
+        self.roles[idx] = roles
+        self.evil[idx] = EVIL_CODES[roles]
+        self.known[idx] = SEES[roles[:, :, None], roles[:, None, :]] & ~np.eye(
+            p, dtype=bool
+        )
+        self.lady_seen[idx] = 0
+        self.quest[idx] = 0
+        self.attempt[idx] = 0
+        self.commander[idx] = 0
+        self.team[idx] = 0
+        self.votes[idx] = 0
+        self.betrayals[idx] = 0
+        self.score[idx] = 0
+        self.lady[idx] = p - 1
+        self.lady_excludes[idx] = 1 << (p - 1)
+        self.winner[idx] = -1
+        self.phase[idx] = NOMINATE
+
+    def reset(self) -> Dict[str, npt.NDArray[np.generic]]:
+        self.deal_into(np.arange(self.num_envs))
+        return self.observe()
+
+    def team_mask(self, idx: Array) -> Mask:
+        mask: Mask = (self.team[idx, None] & self.bits) != 0
+        return mask
+
+    def acting(self) -> Mask:
+        n, p = self.num_envs, self.nplayers
+        act = np.zeros((n, p), dtype=bool)
+        rows = np.arange(n)
+        phase = self.phase
+        act[rows, self.commander] |= phase == NOMINATE
+        act |= (phase == VOTE)[:, None]
+        act |= (phase == BETRAY)[:, None] & self.team_mask(rows)
+        act[rows, self.lady] |= phase == LADY
+        act |= (self.roles == ASSASSIN) & (phase == ASSASSINATE)[:, None]
+        return act
+
+    def observe(self) -> Dict[str, npt.NDArray[np.generic]]:
+        rows = np.arange(self.num_envs)
+        phase = self.phase
+        targets = np.ones((self.num_envs, self.nplayers), dtype=bool)
+        lady = phase == LADY
+        targets[lady] = (self.lady_excludes[lady, None] & self.bits) == 0
+        team = self.team_mask(rows)
+        return {
+            "role": self.roles.copy(),
+            "known": self.known.copy(),
+            "lady_seen": self.lady_seen.copy(),
+            "phase": phase.copy(),
+            "quest": self.quest.copy(),
+            "attempt": self.attempt.copy(),
+            "commander": self.commander.copy(),
+            "lady": self.lady.copy(),
+            "team": team,
+            "votes": self.votes.copy(),
+            "betrayals": self.betrayals.copy(),
+            "score": self.score.copy(),
+            "act": self.acting(),
+            "targets": targets,
+            "team_size": self.team_sizes[
+                np.minimum(self.quest, len(self.team_sizes) - 1)
+            ],
+            "can_betray": team & self.evil & (phase == BETRAY)[:, None],
+        }
+
+    def begin_attempt(self, idx: Array) -> None:
+        self.commander[idx] = (self.commander[idx] + 1) % self.nplayers
+        self.phase[idx] = NOMINATE
+
+    def begin_quest(self, idx: Array) -> None:
+        if (self.quest[idx] >= len(self.rules.quests)).any():
+            raise ValueError("no victory")
+        self.attempt[idx] = 0
+        self.begin_attempt(idx)
+
+    def won(self, idx: Array, side: int) -> None:
+        self.winner[idx] = side
+        self.phase[idx] = DONE
+
+    def nominated(self, idx: Array, nominate: Array) -> None:
+        teams = nominate[idx]
+        sizes = np.bitwise_count(teams.astype(np.uint64))
+        if (teams >> self.nplayers).any() or (teams < 0).any():
+            raise ValueError("Cannot select seats beyond the table")
+        if (sizes != self.team_sizes[self.quest[idx]]).any():
+            raise ValueError("Nominated the wrong number of knights")
+        self.team[idx] = teams
+        forced = self.attempt[idx] >= avalon.MAX_QUEST_VOTES
+        self.phase[idx] = np.where(forced, BETRAY, VOTE)
+
+    def voted(self, idx: Array, votes: Mask) -> None:
+        cast = votes[idx]
+        self.votes[idx] = np.where(cast, 1, -1)
+        approved = cast.sum(axis=1) * 2 > self.nplayers
+        self.phase[idx[approved]] = BETRAY
+        rejected = idx[~approved]
+        self.attempt[rejected] += 1
+        self.begin_attempt(rejected)
+
+    def quested(self, idx: Array, betray: Mask) -> None:
+        team = self.team_mask(idx)
+        cast = betray[idx] & team
+        if (cast & ~self.evil[idx]).any():
+            raise ValueError("Only evil knights may betray a quest")
+        betrayals = cast.sum(axis=1)
+        self.betrayals[idx] = betrayals
+        failed = betrayals >= self.required_fails[self.quest[idx]]
+        self.score[idx, failed.astype(np.int64)] += 1
+        good_won = idx[self.score[idx, GOOD] >= self.wins]
+        evil_won = idx[self.score[idx, EVIL] >= self.wins]
+        if self.assassination:
+            self.phase[good_won] = ASSASSINATE
+        else:
+            self.won(good_won, GOOD)
+        self.won(evil_won, EVIL)
+        going = idx[
+            (self.score[idx, GOOD] < self.wins) & (self.score[idx, EVIL] < self.wins)
+        ]
+        if self.lady_enabled:
+            lady = self.quest[going] >= avalon.LADY_BEGINS_AFTER
+            self.phase[going[lady]] = LADY
+            going = going[~lady]
+        self.quest[going] += 1
+        self.begin_quest(going)
+
+    def revealed(self, idx: Array, target: Array) -> None:
+        chosen = target[idx]
+        if ((chosen < 0) | (chosen >= self.nplayers)).any():
+            raise ValueError("Cannot select seats beyond the table")
+        if ((self.lady_excludes[idx] >> chosen) & 1).any():
+            raise ValueError("The Lady of the Lake cannot visit that seat")
+        holders = self.lady[idx]
+        evil = self.evil[idx, chosen]
+        self.lady_seen[idx, holders, chosen] = np.where(evil, 1, -1)
+        self.lady[idx] = chosen
+        self.lady_excludes[idx] |= 1 << chosen
+        self.quest[idx] += 1
+        self.begin_quest(idx)
+
+    def assassinated(self, idx: Array, target: Array) -> None:
+        chosen = target[idx]
+        if ((chosen < 0) | (chosen >= self.nplayers)).any():
+            raise ValueError("Cannot select seats beyond the table")
+        merlin = self.roles[idx, chosen] == MERLIN
+        self.won(idx[merlin], EVIL)
+        self.won(idx[~merlin], GOOD)
+
+    def step(
+        self,
+        nominate: Optional[Array] = None,
+        votes: Optional[Mask] = None,
+        betray: Optional[Mask] = None,
+        target: Optional[Array] = None,
+    ) -> Tuple[Dict[str, npt.NDArray[np.generic]], npt.NDArray[np.float32], Mask]:
+        n, p = self.num_envs, self.nplayers
+        phase = self.phase.copy()
+        if nominate is None:
+            nominate = np.zeros(n, dtype=np.int64)
+        if votes is None:
+            votes = np.zeros((n, p), dtype=bool)
+        if betray is None:
+            betray = np.zeros((n, p), dtype=bool)
+        if target is None:
+            target = np.zeros(n, dtype=np.int64)
+        self.nominated(np.flatnonzero(phase == NOMINATE), nominate)
+        self.voted(np.flatnonzero(phase == VOTE), votes)
+        self.quested(np.flatnonzero(phase == BETRAY), betray)
+        self.revealed(np.flatnonzero(phase == LADY), target)
+        self.assassinated(np.flatnonzero(phase == ASSASSINATE), target)
+        done = self.phase == DONE
+        rewards = np.zeros((n, p), dtype=np.float32)
+        finished = np.flatnonzero(done)
+        winners = self.evil[finished] == (self.winner[finished, None] == EVIL)
+        rewards[finished] = np.where(winners, 1.0, -1.0)
+        self.deal_into(finished)
+        return self.observe(), rewards, done
+
+
+def random_actions(
+    env: VecEnv, obs: Dict[str, npt.NDArray[np.generic]], rng: np.random.Generator
+) -> Actions:
+    n, p = env.num_envs, env.nplayers
+    order = np.argsort(rng.random((n, p)), axis=1)
+    ranks = np.argsort(order, axis=1)
+    chosen = ranks < np.asarray(obs["team_size"])[:, None]
+    nominate = (chosen * env.bits).sum(axis=1)
+    votes = rng.random((n, p)) < 0.5
+    betray = np.asarray(obs["can_betray"], dtype=bool) & (rng.random((n, p)) < 0.5)
+    scores = np.where(np.asarray(obs["targets"], dtype=bool), rng.random((n, p)), -1)
+    target = scores.argmax(axis=1)
+    return nominate, votes, betray, target
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--envs", type=int, default=4096)
+    parser.add_argument("--players", type=int, default=7)
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    env = VecEnv(
+        args.envs,
+        args.players,
+        [avalon.Role.Merlin, avalon.Role.Assassin, avalon.Role.Percival],
+        {avalon.Flag.Lady},
+        seed=args.seed,
+    )
+    rng = np.random.default_rng(args.seed)
+    obs = env.reset()
+    games = 0
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        obs, _, done = env.step(*random_actions(env, obs, rng))
+        games += int(done.sum())
+    elapsed = time.perf_counter() - start
+    print(
+        f"{args.envs * args.steps / elapsed:.0f} steps/s, {games / elapsed:.0f} games/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+#! /usr/bin/python3
+
+from __future__ import annotations
+
+import collections
+import functools
+import itertools
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+import avalon
+from avalon_mc import Tendencies
+
+ROLES = list(avalon.Role)
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+EVIL_CODES = np.array([role.value.side is avalon.Side.EVIL for role in ROLES])
+PRUNE = 30.0
+
+
+@functools.lru_cache(maxsize=16)
+def assignments(deal: Tuple[int, ...]) -> npt.NDArray[np.int8]:
+    nplayers = len(deal)
+    table = np.full((1, nplayers), -1, dtype=np.int8)
+    for code, count in sorted(collections.Counter(deal).items()):
+        grown = []
+        for seats in itertools.combinations(range(nplayers), count):
+            rows = table[(table[:, seats] < 0).all(axis=1)]
+            rows[:, seats] = code
+            grown.append(rows)
+        table = np.concatenate(grown)
+    table.flags.writeable = False
+    return table
+
+
+@functools.lru_cache(maxsize=None)
+def betray_table(p: float, nplayers: int) -> npt.NDArray[np.float64]:
+    table = np.full((nplayers + 1, nplayers + 1), -np.inf)
+    for evil in range(nplayers + 1):
+        for betrayals in range(evil + 1):
+            prob = (
+                math.comb(evil, betrayals)
+                * p**betrayals
+                * (1 - p) ** (evil - betrayals)
+            )
+            if prob > 0:
+                table[evil, betrayals] = math.log(prob)
+    return table
+
+
+def log(p: float) -> float:
+    return math.log(p) if p > 0 else -math.inf
+
+
+def term(count: npt.NDArray[np.int64], logp: float) -> npt.NDArray[np.float64]:
+    if logp > -math.inf:
+        return count.astype(np.float64) * logp
+    return np.where(count > 0, -math.inf, 0.0)
+
+
+class Beliefs:
+    def __init__(
+        self,
+        deal: Sequence[avalon.Role],
+        tendencies: Optional[Tendencies] = None,
+        seat: Optional[int] = None,
+        known: int = 0,
+    ):
+        self.nplayers = len(deal)
+        self.tendencies = tendencies or Tendencies()
+        self.seat = seat
+        codes = tuple(sorted(ROLE_CODES[role] for role in deal))
+        self.roles = assignments(codes)
+        if seat is not None:
+            role = deal[seat]
+            sees = np.array(
+                [bool(avalon.KNOWS[role] & avalon.ROLE_BITS[o]) for o in ROLES]
+            )
+            bits = 1 << np.arange(self.nplayers, dtype=np.int64)
+            bits[seat] = 0
+            seen = (sees[self.roles] * bits).sum(axis=1)
+            self.roles = self.roles[
+                (self.roles[:, seat] == ROLE_CODES[role]) & (seen == known)
+            ]
+        self.evil = EVIL_CODES[self.roles]
+        self.masks = (self.evil << np.arange(self.nplayers)).sum(axis=1)
+        self.weights = np.zeros(len(self.roles))
+        self.popcount = np.array(
+            [mask.bit_count() for mask in range(1 << self.nplayers)]
+        )
+        self.team = 0
+
+    @classmethod
+    def seated(
+        cls,
+        engine: avalon.Engine,
+        seat: int,
+        tendencies: Optional[Tendencies] = None,
+    ) -> Beliefs:
+        return cls(engine.state.roles, tendencies, seat, engine.seating.known[seat])
+
+    def __len__(self) -> int:
+        return len(self.roles)
+
+    def update(self, loglik: npt.NDArray[np.float64]) -> None:
+        weights = self.weights + loglik
+        best = weights.max(initial=-np.inf)
+        if best == -np.inf:
+            raise ValueError("no role assignment is consistent with the record")
+        keep = weights > best - PRUNE
+        self.weights = weights[keep] - best
+        self.roles = self.roles[keep]
+        self.evil = self.evil[keep]
+        self.masks = self.masks[keep]
+
+    def constrain(self, keep: npt.NDArray[np.bool_]) -> None:
+        self.update(np.where(keep, 0.0, -np.inf))
+
+    def tainted(self) -> npt.NDArray[np.bool_]:
+        tainted: npt.NDArray[np.bool_] = (self.masks & self.team) != 0
+        return tainted
+
+    def votes(self, votes: Sequence[bool]) -> None:
+        t = self.tendencies
+        approvals = sum(1 << seat for seat, vote in enumerate(votes) if vote)
+        yes = self.popcount[self.masks & approvals]
+        no = self.popcount[self.masks & ~approvals]
+        tainted = self.tainted()
+        evil = np.where(tainted, t.evil_approve_tainted, t.evil_approve_clean)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            loglik = (
+                term(votes.count(True) - yes, log(t.good_approve))
+                + term(votes.count(False) - no, log(1 - t.good_approve))
+                + np.where(yes > 0, yes * np.log(evil), 0.0)
+                + np.where(no > 0, no * np.log(1 - evil), 0.0)
+            )
+        self.update(loglik)
+
+    def betrayals(self, betrayals: int) -> None:
+        table = betray_table(self.tendencies.betray, self.nplayers)
+        self.update(table[self.popcount[self.masks & self.team], betrayals])
+
+    def observe(self, event: avalon.Event) -> None:
+        if isinstance(event, avalon.TeamNominated):
+            self.team = sum(1 << seat for seat in event.seats)
+        elif isinstance(event, avalon.TeamVoted):
+            self.votes(event.votes)
+        elif isinstance(event, avalon.QuestCompleted):
+            self.betrayals(event.betrayals)
+        elif isinstance(event, avalon.LadyRevealed):
+            if event.seat == self.seat:
+                evil = event.side is avalon.Side.EVIL
+                self.constrain(self.evil[:, event.target] == evil)
+        elif isinstance(event, avalon.Assassinated):
+            merlin = self.roles[:, event.seat] == ROLE_CODES[avalon.Role.Merlin]
+            self.constrain(merlin == event.merlin)
+
+    def probabilities(self) -> npt.NDArray[np.float64]:
+        weights: npt.NDArray[np.float64] = np.exp(self.weights)
+        probs: npt.NDArray[np.float64] = weights / weights.sum()
+        return probs
+
+    def evil_odds(self) -> List[float]:
+        return [float(p) for p in self.probabilities() @ self.evil]
+
+    def role_odds(self) -> List[Dict[avalon.Role, float]]:
+        probs = self.probabilities()
+        odds: List[Dict[avalon.Role, float]] = []
+        for seat in range(self.nplayers):
+            totals = np.bincount(self.roles[:, seat], probs, minlength=len(ROLES))
+            odds.append(
+                {ROLES[code]: float(p) for code, p in enumerate(totals) if p > 0}
+            )
+        return odds
+
+    def likeliest(self) -> List[avalon.Role]:
+        return [ROLES[code] for code in self.roles[int(self.weights.argmax())]]
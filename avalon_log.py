@@ -0,0 +1,252 @@
+#! /usr/bin/python3
+
+from __future__ import annotations
+
+import argparse
+import collections
+import dataclasses
+import mmap
+import struct
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import avalon
+
+MAGIC = b"AVLG\x01"
+HEADER = struct.Struct("<IBB")
+DECISION = struct.Struct("<BBBH")
+START, DECIDED, END = range(3)
+ROLES = list(avalon.Role)
+PHASES = list(avalon.Phase)
+SIDES = list(avalon.Side)
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+PHASE_CODES = {phase: code for code, phase in enumerate(PHASES)}
+SIDE_CODES = {side: code for code, side in enumerate(SIDES)}
+
+
+def flag_mask(flags: Iterable[avalon.Flag]) -> int:
+    return sum(flag.value for flag in flags)
+
+
+def mask_flags(mask: int) -> Set[avalon.Flag]:
+    return {flag for flag in avalon.Flag if mask & flag.value}
+
+
+class GameRecorder(avalon.Recorder):
+    def __init__(self, log: LogWriter, game: int):
+        self.log = log
+        self.game = game
+
+    def started(self, state: avalon.State) -> None:
+        rules = state.rules
+        payload = bytes(
+            [
+                state.nplayers,
+                flag_mask(state.flags),
+                rules.total_evil,
+                len(rules.quests),
+            ]
+        )
+        payload += bytes(
+            value
+            for quest in rules.quests
+            for value in (quest.num_players, quest.required_fails)
+        )
+        payload += bytes(ROLE_CODES[role] for role in state.roles)
+        self.log.write(self.game, START, payload)
+
+    def decided(self, decision: avalon.Decision) -> None:
+        mask = sum(1 << seat for seat in decision.seats)
+        payload = DECISION.pack(
+            PHASE_CODES[decision.phase], decision.seat, decision.vote, mask
+        )
+        self.log.write(self.game, DECIDED, payload)
+
+    def finished(self, side: avalon.Side) -> None:
+        self.log.write(self.game, END, bytes([SIDE_CODES[side]]))
+        self.log.flush()
+
+
+class LogWriter:
+    def __init__(self, path: str):
+        self.file: BinaryIO = open(path, "ab")
+        self.next_game = 0
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        else:
+            self.next_game, end = tail(path)
+            self.file.truncate(end)
+
+    def recorder(self) -> GameRecorder:
+        game = self.next_game
+        self.next_game += 1
+        return GameRecorder(self, game)
+
+    def write(self, game: int, kind: int, payload: bytes) -> None:
+        self.file.write(HEADER.pack(game, kind, len(payload)) + payload)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self) -> LogWriter:
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+
+def tail(path: str) -> Tuple[int, int]:
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a game log")
+    next_game, end = 0, len(MAGIC)
+    for game, _, payload in records(path):
+        next_game = max(next_game, game + 1)
+        end += HEADER.size + len(payload)
+    return next_game, end
+
+
+def records(path: str) -> Iterator[Tuple[int, int, bytes]]:
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset = len(MAGIC)
+            end = len(data)
+            while offset + HEADER.size <= end:
+                game, kind, size = HEADER.unpack_from(data, offset)
+                offset += HEADER.size
+                if offset + size > end:
+                    return
+                yield game, kind, data[offset : offset + size]
+                offset += size
+
+
+@dataclasses.dataclass
+class GameRecord:
+    roles: List[avalon.Role]
+    flags: Set[avalon.Flag]
+    rules: avalon.Rules
+    decisions: List[avalon.Decision] = dataclasses.field(default_factory=list)
+    winner: Optional[avalon.Side] = None
+
+
+def parse_start(payload: bytes) -> GameRecord:
+    nplayers, flags, total_evil, nquests = payload[:4]
+    quests = [
+        avalon.Quest(payload[4 + 2 * idx], payload[5 + 2 * idx])
+        for idx in range(nquests)
+    ]
+    roles = payload[4 + 2 * nquests : 4 + 2 * nquests + nplayers]
+    return GameRecord(
+        roles=[ROLES[code] for code in roles],
+        flags=mask_flags(flags),
+        rules=avalon.Rules(total_evil, quests),
+    )
+
+
+def parse_decision(payload: bytes) -> avalon.Decision:
+    phase, seat, vote, mask = DECISION.unpack(payload)
+    return avalon.Decision(
+        PHASES[phase], seat, bool(vote), tuple(avalon.mask_seats(mask))
+    )
+
+
+def games(paths: Iterable[str]) -> Iterator[GameRecord]:
+    for path in paths:
+        live: Dict[int, GameRecord] = {}
+        for game, kind, payload in records(path):
+            if kind == START:
+                live[game] = parse_start(payload)
+            elif kind == DECIDED and game in live:
+                live[game].decisions.append(parse_decision(payload))
+            elif kind == END and game in live:
+                record = live.pop(game)
+                record.winner = SIDES[payload[0]]
+                yield record
+
+
+def rerun(record: GameRecord) -> Optional[avalon.Side]:
+    engine = avalon.Engine(list(record.roles), record.rules, set(record.flags))
+    engine.start()
+    for decision in record.decisions:
+        engine.apply(decision)
+    return engine.state.winner
+
+
+@dataclasses.dataclass
+class Summary:
+    games: int = 0
+    wins: collections.Counter[avalon.Side] = dataclasses.field(
+        default_factory=collections.Counter
+    )
+    role_games: collections.Counter[avalon.Role] = dataclasses.field(
+        default_factory=collections.Counter
+    )
+    role_wins: collections.Counter[avalon.Role] = dataclasses.field(
+        default_factory=collections.Counter
+    )
+    assassinations: int = 0
+
+    def fold(self, paths: Iterable[str]) -> Summary:
+        assassinate = PHASE_CODES[avalon.Phase.ASSASSINATE]
+        evil = SIDE_CODES[avalon.Side.EVIL]
+        for path in paths:
+            roles: Dict[int, bytes] = {}
+            attempted: Set[int] = set()
+            for game, kind, payload in records(path):
+                if kind == START:
+                    nquests = payload[3]
+                    roles[game] = payload[4 + 2 * nquests :]
+                elif kind == DECIDED:
+                    if payload[0] == assassinate:
+                        attempted.add(game)
+                elif kind == END:
+                    winner = SIDES[payload[0]]
+                    self.games += 1
+                    self.wins[winner] += 1
+                    for code in roles.pop(game):
+                        role = ROLES[code]
+                        self.role_games[role] += 1
+                        if role.value.side is winner:
+                            self.role_wins[role] += 1
+                    if game in attempted:
+                        attempted.discard(game)
+                        self.assassinations += payload[0] == evil
+        return self
+
+    def report(self) -> str:
+        def rate(n: int, total: int) -> str:
+            return f"{n / total:.1%}" if total else "-"
+
+        lines = [f"Games: {self.games}"]
+        for side in avalon.Side:
+            lines.append(f"{side.value}: {rate(self.wins[side], self.games)}")
+        lines.append(f"Merlin assassinated: {rate(self.assassinations, self.games)}")
+        for role, n in sorted(self.role_games.items(), key=lambda item: item[0].name):
+            lines.append(f"{role.value.name}: {rate(self.role_wins[role], n)}")
+        return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["summary", "verify"])
+    parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+    if args.command == "summary":
+        print(Summary().fold(args.paths).report())
+        return
+    checked = mismatched = 0
+    for record in games(args.paths):
+        checked += 1
+        if rerun(record) is not record.winner:
+            mismatched += 1
+    print(f"Verified {checked} games, {mismatched} mismatched")
+    if mismatched:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
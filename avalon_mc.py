@@ -0,0 +1,179 @@
+#! /usr/bin/python3
+
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import math
+import random
+from typing import List, Optional, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+import avalon
+
+Z95 = 1.959963984540054
+
+
+@dataclasses.dataclass
+class Tendencies:
+    good_approve: float = 0.6
+    evil_approve_tainted: float = 0.9
+    evil_approve_clean: float = 0.3
+    betray: float = 0.8
+    assassin_hit: Optional[float] = None
+
+
+@dataclasses.dataclass
+class Estimate:
+    games: int
+    good_wins: int
+    assassinations: int
+    quest_good: List[float]
+
+    @property
+    def good(self) -> float:
+        return self.good_wins / self.games
+
+    @property
+    def evil(self) -> float:
+        return 1 - self.good
+
+    def interval(self, z: float = Z95) -> Tuple[float, float]:
+        n, p = self.games, self.good
+        centre = (p + z * z / (2 * n)) / (1 + z * z / n)
+        spread = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+        return centre - spread, centre + spread
+
+    def report(self) -> str:
+        low, high = self.interval()
+        lines = [
+            f"Games: {self.games}",
+            f"Good: {self.good:.2%} (95% CI {low:.2%} - {high:.2%})",
+            f"Evil: {self.evil:.2%}",
+            f"Merlin assassinated: {self.assassinations / self.games:.2%}",
+        ]
+        for idx, good in enumerate(self.quest_good):
+            lines.append(f"Quest {idx + 1}: {good:.1%} good")
+        return "\n".join(lines)
+
+
+def random_teams(
+    rng: np.random.Generator, games: int, nplayers: int, size: int
+) -> npt.NDArray[np.bool_]:
+    order = np.argsort(rng.random((games, nplayers)), axis=1)
+    teams = np.zeros((games, nplayers), dtype=bool)
+    np.put_along_axis(teams, order[:, :size], True, axis=1)
+    return teams
+
+
+def estimate(
+    nplayers: int,
+    games: int,
+    roles: Optional[List[avalon.Role]] = None,
+    rules: Optional[avalon.Rules] = None,
+    tendencies: Optional[Tendencies] = None,
+    seed: int = 0,
+) -> Estimate:
+    rules = rules or avalon._default_rules[nplayers]
+    tendencies = tendencies or Tendencies()
+    roles = roles or []
+    deal = avalon.deal_roles(nplayers, roles, rules, random.Random(seed))
+    rng = np.random.default_rng(seed)
+    evil = np.argsort(rng.random((games, nplayers)), axis=1) < rules.total_evil
+    approve_clean = np.where(
+        evil, tendencies.evil_approve_clean, tendencies.good_approve
+    )
+    approve_tainted = np.where(
+        evil, tendencies.evil_approve_tainted, tendencies.good_approve
+    )
+    majority = nplayers // 2 + 1
+    wins = len(rules.quests) // 2 + 1
+    good = np.zeros(games, dtype=np.int64)
+    bad = np.zeros(games, dtype=np.int64)
+    quest_good: List[float] = []
+    for quest in rules.quests:
+        live = np.flatnonzero((good < wins) & (bad < wins))
+        if not len(live):
+            break
+        teams = np.zeros((len(live), nplayers), dtype=bool)
+        pending = np.ones(len(live), dtype=bool)
+        for attempt in range(avalon.MAX_QUEST_VOTES + 1):
+            idx = np.flatnonzero(pending)
+            drawn = random_teams(rng, len(idx), nplayers, quest.num_players)
+            if attempt < avalon.MAX_QUEST_VOTES:
+                tainted = (drawn & evil[live[idx]]).sum(axis=1) > 0
+                rates = np.where(
+                    tainted[:, None],
+                    approve_tainted[live[idx]],
+                    approve_clean[live[idx]],
+                )
+                votes = rng.random(rates.shape) < rates
+                approved = votes.sum(axis=1) >= majority
+                idx, drawn = idx[approved], drawn[approved]
+            teams[idx] = drawn
+            pending[idx] = False
+        traitors = (teams & evil[live]).sum(axis=1)
+        betrayals = rng.binomial(traitors, tendencies.betray)
+        failed = betrayals >= quest.required_fails
+        bad[live] += failed
+        good[live] += ~failed
+        quest_good.append(float((~failed).mean()))
+    if ((good < wins) & (bad < wins)).any():
+        raise ValueError("no victory")
+    good_won = good >= wins
+    assassinations = 0
+    if deal.count(avalon.Role.Merlin) == 1 and deal.count(avalon.Role.Assassin) == 1:
+        hit = tendencies.assassin_hit
+        if hit is None:
+            hit = 1 / (nplayers - rules.total_evil)
+        struck = good_won & (rng.random(games) < hit)
+        assassinations = int(struck.sum())
+        good_won &= ~struck
+    return Estimate(games, int(good_won.sum()), assassinations, quest_good)
+
+
+def parse_quests(quests: str) -> List[avalon.Quest]:
+    return [
+        avalon.Quest(*(int(part) for part in quest.split(":", 1)))
+        for quest in quests.split(",")
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--players", type=int, default=5)
+    parser.add_argument(
+        "--roles", nargs="*", default=[], choices=avalon.Role.__members__
+    )
+    parser.add_argument("--games", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--evil", type=int, help="override the number of evil players")
+    parser.add_argument("--quests", help="override quests, e.g. 2:1,3:1,2:1,3:1,3:1")
+    defaults = Tendencies()
+    for field in dataclasses.fields(Tendencies):
+        option = "--" + field.name.replace("_", "-")
+        parser.add_argument(option, type=float, default=getattr(defaults, field.name))
+    args = parser.parse_args()
+    base = avalon._default_rules[args.players]
+    rules = avalon.Rules(
+        base.total_evil if args.evil is None else args.evil,
+        base.quests if args.quests is None else parse_quests(args.quests),
+    )
+    tendencies = Tendencies(
+        *(getattr(args, field.name) for field in dataclasses.fields(Tendencies))
+    )
+    result = estimate(
+        args.players,
+        args.games,
+        [avalon.Role[role] for role in args.roles],
+        rules,
+        tendencies,
+        args.seed,
+    )
+    print(result.report())
+
+
+if __name__ == "__main__":
+    main()
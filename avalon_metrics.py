@@ -0,0 +1,131 @@
+#! /usr/bin/python3
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+import collections
+from typing import Dict, List, Sequence, Tuple
+
+import avalon
+
+BUCKETS = (0.001, 0.01, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0)
+ADDRESS = ("127.0.0.1", 9715)
+MAX_SERIES = 1024
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    return ",".join(f'{key}="{escape(value)}"' for key, value in pairs)
+
+
+def render(
+    name: str,
+    help: str,
+    series: Dict[Tuple[Tuple[str, str], ...], Histogram],
+) -> List[str]:
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} histogram"]
+    for key, hist in sorted(series.items()):
+        total = 0
+        bounds = [repr(bound) for bound in hist.buckets] + ["+Inf"]
+        for bound, count in zip(bounds, hist.counts):
+            total += count
+            pairs = labels(key + (("le", bound),))
+            lines.append(f"{name}_bucket{{{pairs}}} {total}")
+        lines.append(f"{name}_sum{{{labels(key)}}} {hist.sum!r}")
+        lines.append(f"{name}_count{{{labels(key)}}} {total}")
+    return lines
+
+
+class Registry(avalon.Metrics):
+    def __init__(
+        self,
+        buckets: Sequence[float] = BUCKETS,
+        max_series: int = MAX_SERIES,
+    ):
+        self.buckets = buckets
+        self.max_series = max_series
+        self.phases: Dict[Tuple[Tuple[str, str], ...], Histogram] = {}
+        self.decisions: collections.OrderedDict[
+            Tuple[Tuple[str, str], ...], Histogram
+        ] = collections.OrderedDict()
+
+    def histogram(
+        self,
+        series: Dict[Tuple[Tuple[str, str], ...], Histogram],
+        key: Tuple[Tuple[str, str], ...],
+    ) -> Histogram:
+        hist = series.get(key)
+        if hist is None:
+            hist = series[key] = Histogram(self.buckets)
+        return hist
+
+    def phase(self, phase: str, seconds: float) -> None:
+        self.histogram(self.phases, (("phase", phase),)).observe(seconds)
+
+    def decision(self, player: str, phase: str, seconds: float) -> None:
+        key = (("player", player), ("phase", phase))
+        self.histogram(self.decisions, key).observe(seconds)
+        self.decisions.move_to_end(key)
+        while len(self.decisions) > self.max_series:
+            self.decisions.popitem(last=False)
+
+    def export(self) -> str:
+        lines = render(
+            "avalon_phase_seconds",
+            "Wall time spent announcing and waiting on each game phase.",
+            self.phases,
+        )
+        lines += render(
+            "avalon_decision_seconds",
+            "Time each player took to answer a prompt.",
+            self.decisions,
+        )
+        return "\n".join(lines) + "\n"
+
+
+async def serve(registry: Registry, address: Tuple[str, int] = ADDRESS) -> None:
+    async def handle(
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = registry.export().encode()
+            writer.write(
+                b"HTTP/1.0 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            ConnectionError,
+        ):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, *address)
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,321 @@
+#! /usr/bin/python3
+
+from __future__ import annotations
+
+import abc
+import argparse
+import collections
+import concurrent.futures
+import dataclasses
+import itertools
+import os
+import random
+from typing import Dict, List, Optional, Set, Tuple
+
+import avalon
+import avalon_log
+
+
+@dataclasses.dataclass
+class QuestRecord:
+    knights: Tuple[int, ...]
+    betrayals: int
+
+
+class Policy(abc.ABC):
+    @abc.abstractmethod
+    def nominate(self, bot: Bot, count: int, candidates: List[int]) -> List[int]: ...
+
+    @abc.abstractmethod
+    def approve(self, bot: Bot, team: Tuple[int, ...]) -> bool: ...
+
+    @abc.abstractmethod
+    def betray(self, bot: Bot) -> bool: ...
+
+    def reveal(self, bot: Bot, candidates: List[int]) -> int:
+        return bot.rng.choice(candidates)
+
+    def assassinate(self, bot: Bot, candidates: List[int]) -> int:
+        return bot.rng.choice(candidates)
+
+
+class RandomPolicy(Policy):
+    def nominate(self, bot: Bot, count: int, candidates: List[int]) -> List[int]:
+        return bot.rng.sample(candidates, count)
+
+    def approve(self, bot: Bot, team: Tuple[int, ...]) -> bool:
+        return bot.rng.random() < 0.5
+
+    def betray(self, bot: Bot) -> bool:
+        return bot.rng.random() < 0.5
+
+
+class HeuristicPolicy(Policy):
+    @staticmethod
+    def suspicion(bot: Bot, seat: int) -> float:
+        if seat == bot.seat:
+            return 0.0
+        if seat in bot.evil_known:
+            return float("inf")
+        return sum(
+            record.betrayals / len(record.knights)
+            for record in bot.game.history
+            if seat in record.knights
+        )
+
+    def ranked(self, bot: Bot, candidates: List[int]) -> List[int]:
+        shuffled = bot.rng.sample(candidates, len(candidates))
+        return sorted(shuffled, key=lambda seat: self.suspicion(bot, seat))
+
+    def nominate(self, bot: Bot, count: int, candidates: List[int]) -> List[int]:
+        others = [seat for seat in candidates if seat != bot.seat]
+        if bot.evil:
+            others = [seat for seat in others if seat not in bot.evil_known]
+        return [bot.seat] + self.ranked(bot, others)[: count - 1]
+
+    def approve(self, bot: Bot, team: Tuple[int, ...]) -> bool:
+        if bot.evil:
+            return bot.seat in team or any(seat in bot.evil_known for seat in team)
+        everyone = range(len(bot.game.bots))
+        best = sorted(self.suspicion(bot, seat) for seat in everyone)[: len(team)]
+        return sum(self.suspicion(bot, seat) for seat in team) <= sum(best)
+
+    def betray(self, bot: Bot) -> bool:
+        return True
+
+    def reveal(self, bot: Bot, candidates: List[int]) -> int:
+        return self.ranked(bot, candidates)[-1]
+
+    def assassinate(self, bot: Bot, candidates: List[int]) -> int:
+        goods = [seat for seat in candidates if seat not in bot.evil_known]
+        return bot.rng.choice(goods or candidates)
+
+
+POLICIES: Dict[str, Policy] = {
+    "random": RandomPolicy(),
+    "heuristic": HeuristicPolicy(),
+}
+
+
+class Bot:
+    def __init__(self, seat: int, game: SimGame, policy: Policy):
+        self.seat = seat
+        self.game = game
+        self.rng = game.rng
+        self.role = game.engine.state.roles[seat]
+        self.policy = policy
+        self.evil_known: Set[int] = set()
+        if self.evil or self.role is avalon.Role.Merlin:
+            self.evil_known = set(game.engine.seating.known_seats(seat))
+
+    @property
+    def evil(self) -> bool:
+        return self.role.value.side is avalon.Side.EVIL
+
+    def decide(self, prompt: avalon.Prompt) -> avalon.Decision:
+        if prompt.phase is avalon.Phase.VOTE:
+            return prompt.answer_vote(self.policy.approve(self, self.game.team))
+        if prompt.phase is avalon.Phase.BETRAY:
+            return prompt.answer_vote(self.evil and self.policy.betray(self))
+        candidates = [
+            seat for seat in range(len(self.game.bots)) if seat not in prompt.exclude
+        ]
+        if prompt.phase is avalon.Phase.LADY:
+            return prompt.answer_seats([self.policy.reveal(self, candidates)])
+        if prompt.phase is avalon.Phase.ASSASSINATE:
+            return prompt.answer_seats([self.policy.assassinate(self, candidates)])
+        return prompt.answer_seats(self.policy.nominate(self, prompt.count, candidates))
+
+
+@dataclasses.dataclass
+class SimConfig:
+    nplayers: int
+    roles: List[avalon.Role]
+    flags: Set[avalon.Flag] = dataclasses.field(default_factory=set)
+    rules: Optional[avalon.Rules] = None
+    policies: Dict[avalon.Side, str] = dataclasses.field(
+        default_factory=lambda: {side: "heuristic" for side in avalon.Side}
+    )
+
+    def __post_init__(self) -> None:
+        if avalon.Flag.NoQuests in self.flags:
+            raise ValueError("Simulated games need quests to pick a winner")
+
+
+class SimGame:
+    def __init__(
+        self,
+        config: SimConfig,
+        rng: random.Random,
+        recorder: Optional[avalon.Recorder] = None,
+    ):
+        self.rng = rng
+        rules = config.rules or avalon._default_rules[config.nplayers]
+        roles = avalon.deal_roles(config.nplayers, config.roles, rules, rng)
+        self.engine = avalon.Engine(roles, rules, config.flags, recorder)
+        self.bots = [
+            Bot(seat, self, POLICIES[config.policies[role.value.side]])
+            for seat, role in enumerate(roles)
+        ]
+        self.team: Tuple[int, ...] = ()
+        self.history: List[QuestRecord] = []
+        self.quest_winners: List[avalon.Side] = []
+        self.assassinated = False
+
+    @property
+    def winner(self) -> avalon.Side:
+        assert self.engine.state.winner is not None
+        return self.engine.state.winner
+
+    def observe(self, event: avalon.Event) -> None:
+        if isinstance(event, avalon.TeamNominated):
+            self.team = event.seats
+        elif isinstance(event, avalon.QuestCompleted):
+            self.history.append(QuestRecord(self.team, event.betrayals))
+            self.quest_winners.append(event.winner)
+        elif isinstance(event, avalon.Assassinated):
+            self.assassinated = event.merlin
+
+    def play(self) -> None:
+        engine = self.engine
+        engine.start()
+        while True:
+            for event in engine.drain():
+                self.observe(event)
+            prompts = engine.pending_decisions()
+            if not prompts:
+                break
+            for prompt in prompts:
+                engine.apply(self.bots[prompt.seat].decide(prompt))
+
+
+@dataclasses.dataclass
+class Stats:
+    games: int = 0
+    wins: collections.Counter[avalon.Side] = dataclasses.field(
+        default_factory=collections.Counter
+    )
+    role_games: collections.Counter[avalon.Role] = dataclasses.field(
+        default_factory=collections.Counter
+    )
+    role_wins: collections.Counter[avalon.Role] = dataclasses.field(
+        default_factory=collections.Counter
+    )
+    quest_wins: Dict[int, collections.Counter[avalon.Side]] = dataclasses.field(
+        default_factory=lambda: collections.defaultdict(collections.Counter)
+    )
+    assassinations: int = 0
+
+    def add(self, game: SimGame) -> None:
+        winner = game.winner
+        self.games += 1
+        self.wins[winner] += 1
+        for bot in game.bots:
+            self.role_games[bot.role] += 1
+            if bot.role.value.side is winner:
+                self.role_wins[bot.role] += 1
+        for idx, side in enumerate(game.quest_winners):
+            self.quest_wins[idx][side] += 1
+        self.assassinations += game.assassinated
+
+    def merge(self, other: Stats) -> None:
+        self.games += other.games
+        self.wins.update(other.wins)
+        self.role_games.update(other.role_games)
+        self.role_wins.update(other.role_wins)
+        for idx, ctr in other.quest_wins.items():
+            self.quest_wins[idx].update(ctr)
+        self.assassinations += other.assassinations
+
+    def report(self) -> str:
+        def rate(n: int, total: int) -> str:
+            return f"{n / total:.1%}" if total else "-"
+
+        lines = [f"Games: {self.games}"]
+        for side in avalon.Side:
+            lines.append(f"{side.value}: {rate(self.wins[side], self.games)}")
+        lines.append(f"Merlin assassinated: {rate(self.assassinations, self.games)}")
+        for role, n in sorted(self.role_games.items(), key=lambda item: item[0].name):
+            lines.append(f"{role.value.name}: {rate(self.role_wins[role], n)}")
+        for idx, ctr in sorted(self.quest_wins.items()):
+            played = sum(ctr.values())
+            good = rate(ctr[avalon.Side.GOOD], played)
+            lines.append(f"Quest {idx + 1}: {good} good of {played}")
+        return "\n".join(lines)
+
+
+def run_shard(
+    config: SimConfig, seed: int, games: int, log: Optional[str] = None
+) -> Stats:
+    rng = random.Random(seed)
+    stats = Stats()
+    writer = avalon_log.LogWriter(log) if log is not None else None
+    for _ in range(games):
+        recorder = writer.recorder() if writer is not None else None
+        game = SimGame(config, rng, recorder)
+        game.play()
+        stats.add(game)
+    if writer is not None:
+        writer.close()
+    return stats
+
+
+def simulate(
+    config: SimConfig,
+    games: int,
+    workers: int = 1,
+    seed: int = 0,
+    shard: int = 1000,
+    log: Optional[str] = None,
+) -> Stats:
+    seeder = random.Random(seed)
+    counts = [min(shard, games - start) for start in range(0, games, shard)]
+    seeds = [seeder.getrandbits(64) for _ in counts]
+    logs: List[Optional[str]] = [None] * len(counts)
+    if log is not None:
+        os.makedirs(log, exist_ok=True)
+        logs = [os.path.join(log, f"{shard_seed:016x}.avlog") for shard_seed in seeds]
+    args = (itertools.repeat(config), seeds, counts, logs)
+    total = Stats()
+    if workers == 1:
+        for stats in map(run_shard, *args):
+            total.merge(stats)
+        return total
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        for stats in pool.map(run_shard, *args):
+            total.merge(stats)
+    return total
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--players", type=int, default=5)
+    parser.add_argument(
+        "--roles", nargs="*", default=[], choices=avalon.Role.__members__
+    )
+    parser.add_argument(
+        "--flags",
+        nargs="*",
+        default=[],
+        choices=[flag.name for flag in avalon.Flag if flag is not avalon.Flag.NoQuests],
+    )
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--shard", type=int, default=1000)
+    parser.add_argument("--good", choices=POLICIES, default="heuristic")
+    parser.add_argument("--evil", choices=POLICIES, default="heuristic")
+    parser.add_argument("--log")
+    args = parser.parse_args()
+    config = SimConfig(
+        nplayers=args.players,
+        roles=[avalon.Role[role] for role in args.roles],
+        flags={avalon.Flag[flag] for flag in args.flags},
+        policies={avalon.Side.GOOD: args.good, avalon.Side.EVIL: args.evil},
+    )
+    stats = simulate(config, args.games, args.workers, args.seed, args.shard, args.log)
+    print(stats.report())
+
+
+if __name__ == "__main__":
+    main()
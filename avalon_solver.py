@@ -0,0 +1,435 @@
+#! /usr/bin/python3
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import dataclasses
+import itertools
+import multiprocessing
+import multiprocessing.connection
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+import avalon
+from avalon_mc import parse_quests
+
+GOOD, EVIL, TERMINAL = range(3)
+NOMINATE, VOTE_GOOD, VOTE_EVIL, BETRAY = range(4)
+MAX_STATES = 2_000_000
+EPSILON = 1e-12
+
+State = Tuple[int, Tuple[Tuple[int, int, bool], ...], int, int, int, int, int]
+
+
+@dataclasses.dataclass
+class Node:
+    actor: int
+    key: Hashable = None
+    children: List[int] = dataclasses.field(default_factory=list)
+    value: float = 0.0
+
+
+@dataclasses.dataclass
+class Config:
+    nplayers: int
+    rules: avalon.Rules
+    assassination: bool = False
+
+    @property
+    def wins(self) -> int:
+        return len(self.rules.quests) // 2 + 1
+
+    def good_value(self) -> float:
+        if not self.assassination:
+            return 1.0
+        return 1.0 - 1.0 / (self.nplayers - self.rules.total_evil)
+
+    def deals(self) -> List[int]:
+        return [
+            sum(1 << seat for seat in seats)
+            for seats in itertools.combinations(
+                range(self.nplayers), self.rules.total_evil
+            )
+        ]
+
+
+class Tree:
+    def __init__(self, config: Config, deals: Sequence[int]):
+        self.config = config
+        self.nodes: List[Node] = []
+        self.index: Dict[State, int] = {}
+        self.roots = [self.node((evil, (), 0, 0, NOMINATE, 0, 0)) for evil in deals]
+        self.expand()
+        self.order = self.topological()
+
+    def node(self, state: State) -> int:
+        idx = self.index.get(state)
+        if idx is None:
+            if len(self.nodes) >= MAX_STATES:
+                raise ValueError("configuration is too large to solve exactly")
+            idx = self.index[state] = len(self.nodes)
+            self.nodes.append(Node(TERMINAL))
+        return idx
+
+    def expand(self) -> None:
+        config = self.config
+        n, nevil = config.nplayers, config.rules.total_evil
+        pending = list(self.index.items())
+        while pending:
+            state, idx = pending.pop()
+            evil, record, attempt, commander, phase, team, good_vote = state
+            node = self.nodes[idx]
+            public = (record, attempt, commander, phase, team)
+            children: List[State] = []
+            if phase == NOMINATE:
+                node.actor = EVIL if evil >> commander & 1 else GOOD
+                size = config.rules.quests[len(record)].num_players
+                after = BETRAY if attempt >= avalon.MAX_QUEST_VOTES else VOTE_GOOD
+                for seats in itertools.combinations(range(n), size):
+                    chosen = sum(1 << seat for seat in seats)
+                    children.append(
+                        (evil, record, attempt, commander, after, chosen, 0)
+                    )
+            elif phase == VOTE_GOOD:
+                node.actor = GOOD
+                for vote in (0, 1):
+                    children.append(
+                        (evil, record, attempt, commander, VOTE_EVIL, team, vote)
+                    )
+            elif phase == VOTE_EVIL:
+                node.actor = EVIL
+                for vote in (0, 1):
+                    approvals = (n - nevil) * good_vote + nevil * vote
+                    if approvals * 2 > n:
+                        children.append(
+                            (evil, record, attempt, commander, BETRAY, team, 0)
+                        )
+                    else:
+                        nxt = (commander + 1) % n
+                        children.append(
+                            (evil, record, attempt + 1, nxt, NOMINATE, 0, 0)
+                        )
+            else:
+                node.actor = EVIL
+                quest = config.rules.quests[len(record)]
+                for betrayals in range((evil & team).bit_count() + 1):
+                    failed = betrayals >= quest.required_fails
+                    entry = (team, betrayals, failed)
+                    after_quest = tuple(sorted(record + (entry,)))
+                    nxt = (commander + 1) % n
+                    children.append((evil, after_quest, 0, nxt, NOMINATE, 0, 0))
+            node.key = public if node.actor == GOOD else (evil,) + public
+            for child in children:
+                before = len(self.nodes)
+                cidx = self.node(child)
+                node.children.append(cidx)
+                if len(self.nodes) > before:
+                    self.settle(child, cidx, pending)
+
+    def settle(self, state: State, idx: int, pending: List[Tuple[State, int]]) -> None:
+        config = self.config
+        record = state[1]
+        failed = sum(entry[2] for entry in record)
+        if failed >= config.wins:
+            self.nodes[idx].value = 0.0
+        elif len(record) - failed >= config.wins:
+            self.nodes[idx].value = config.good_value()
+        elif len(record) >= len(config.rules.quests):
+            raise ValueError("no victory")
+        else:
+            pending.append((state, idx))
+
+    def topological(self) -> List[int]:
+        indegree = [0] * len(self.nodes)
+        for node in self.nodes:
+            for child in node.children:
+                indegree[child] += 1
+        order = [idx for idx in self.roots if not indegree[idx]]
+        for idx in order:
+            for child in self.nodes[idx].children:
+                indegree[child] -= 1
+                if not indegree[child]:
+                    order.append(child)
+        return order
+
+
+Array = npt.NDArray[np.float64]
+Index = npt.NDArray[np.int64]
+
+
+def matched(regrets: Array, info: Index, counts: Index) -> Array:
+    positive = np.where(regrets > EPSILON, regrets, 0.0)
+    sums = np.bincount(info, positive, minlength=len(counts))[info]
+    uniform = 1.0 / counts[info]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sigma: Array = np.where(sums > 0, positive / sums, uniform)
+    return sigma
+
+
+def scatter(index: Index, weights: Array, size: int) -> Array:
+    return np.bincount(index, weights, minlength=size).astype(np.float64, copy=False)
+
+
+class Solver:
+    def __init__(self, tree: Tree, chance: float):
+        nodes = tree.nodes
+        self.chance = chance
+        self.roots = np.array(tree.roots)
+        level = [0] * len(nodes)
+        for idx in tree.order:
+            for child in nodes[idx].children:
+                level[child] = max(level[child], level[idx] + 1)
+        self.values = np.array([node.value for node in nodes])
+        offsets: Dict[Tuple[int, Hashable], int] = {}
+        self.good_keys: List[Tuple[Hashable, int]] = []
+        good_slots: List[int] = []
+        info: List[int] = []
+        counts: List[int] = []
+        parents: List[int] = []
+        children: List[int] = []
+        slots: List[int] = []
+        for idx, node in enumerate(nodes):
+            if node.actor == TERMINAL:
+                continue
+            base = offsets.get((node.actor, node.key))
+            if base is None:
+                base = offsets[(node.actor, node.key)] = len(info)
+                info.extend([len(counts)] * len(node.children))
+                counts.append(len(node.children))
+                if node.actor == GOOD:
+                    self.good_keys.append((node.key, len(node.children)))
+                    good_slots.extend(range(base, base + len(node.children)))
+            for action, child in enumerate(node.children):
+                parents.append(idx)
+                children.append(child)
+                slots.append(base + action)
+        self.info = np.array(info)
+        self.counts = np.array(counts)
+        self.good_slots = np.array(good_slots, dtype=np.int64)
+        self.good_global = np.zeros(0, dtype=np.int64)
+        self.parent = np.array(parents)
+        self.child = np.array(children)
+        self.slot = np.array(slots)
+        actors = np.array([node.actor for node in nodes])
+        self.good_edge = actors[self.parent] == GOOD
+        edge_level = np.array(level)[self.parent]
+        self.levels = [
+            np.flatnonzero(edge_level == depth) for depth in range(max(level) + 1)
+        ]
+        self.regrets = np.zeros(len(info))
+        self.totals = np.zeros(len(info))
+
+    def bind(self, offsets: Dict[Hashable, int]) -> None:
+        self.good_global = np.array(
+            [
+                offsets[key] + action
+                for key, count in self.good_keys
+                for action in range(count)
+            ],
+            dtype=np.int64,
+        )
+
+    def sigma(self, good: Array, evil: Array) -> Array:
+        sigma = matched(evil, self.info, self.counts)
+        sigma[self.good_slots] = good[self.good_global]
+        return sigma
+
+    def backward(self, probs: Array) -> Array:
+        values = self.values.copy()
+        for edges in reversed(self.levels):
+            np.add.at(
+                values, self.parent[edges], probs[edges] * values[self.child[edges]]
+            )
+        return values
+
+    def iterate(self, good: Array, weight: float) -> Tuple[Array, Array]:
+        probs = self.sigma(good, self.regrets)[self.slot]
+        count = len(self.values)
+        own_good, own_evil = np.zeros(count), np.zeros(count)
+        other_good, other_evil = np.zeros(count), np.zeros(count)
+        own_good[self.roots] = own_evil[self.roots] = 1.0
+        other_good[self.roots] = other_evil[self.roots] = self.chance
+        for edges in self.levels:
+            parent, child = self.parent[edges], self.child[edges]
+            prob, good_edge = probs[edges], self.good_edge[edges]
+            mine = np.where(good_edge, prob, 1.0)
+            theirs = np.where(good_edge, 1.0, prob)
+            np.add.at(own_good, child, own_good[parent] * mine)
+            np.add.at(own_evil, child, own_evil[parent] * theirs)
+            np.add.at(other_good, child, other_good[parent] * theirs)
+            np.add.at(other_evil, child, other_evil[parent] * mine)
+        values = self.backward(probs)
+        diff = values[self.child] - values[self.parent]
+        regrets = np.where(
+            self.good_edge,
+            other_good[self.parent] * diff,
+            -other_evil[self.parent] * diff,
+        )
+        own = np.where(self.good_edge, own_good[self.parent], own_evil[self.parent])
+        slots = len(self.info)
+        delta = scatter(self.slot, regrets, slots)
+        totals = scatter(self.slot, weight * own * probs, slots)
+        self.regrets = np.maximum(self.regrets + delta, 0.0)
+        self.totals += totals
+        size = len(good)
+        return (
+            scatter(self.good_global, delta[self.good_slots], size),
+            scatter(self.good_global, totals[self.good_slots], size),
+        )
+
+    def evaluate(self, good: Array) -> float:
+        probs = self.sigma(good, self.totals)[self.slot]
+        values = self.backward(probs)
+        return float(values[self.roots].sum() * self.chance)
+
+
+def serve(
+    conn: multiprocessing.connection.Connection,
+    config: Config,
+    deals: List[int],
+    chance: float,
+) -> None:
+    with conn:
+        try:
+            solver = Solver(Tree(config, deals), chance)
+        except Exception as e:
+            conn.send(e)
+            return
+        conn.send(solver.good_keys)
+        offsets = conn.recv()
+        if offsets is None:
+            return
+        solver.bind(offsets)
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+            command, good, weight = message
+            if command == "iterate":
+                conn.send(solver.iterate(good, weight))
+            else:
+                conn.send(solver.evaluate(good))
+
+
+@dataclasses.dataclass
+class Solution:
+    value: float
+    iterations: int
+    good: Dict[Hashable, List[float]]
+
+
+def solve(
+    nplayers: int,
+    rules: Optional[avalon.Rules] = None,
+    roles: Optional[List[avalon.Role]] = None,
+    iterations: int = 200,
+    workers: int = 1,
+) -> Solution:
+    rules = rules or avalon._default_rules[nplayers]
+    roles = roles or []
+    config = Config(
+        nplayers,
+        rules,
+        avalon.Role.Merlin in roles and avalon.Role.Assassin in roles,
+    )
+    deals = config.deals()
+    chance = 1.0 / len(deals)
+    local: Optional[Solver] = None
+    pipes: List[multiprocessing.connection.Connection] = []
+    procs: List[multiprocessing.Process] = []
+    keys: Dict[Hashable, int] = {}
+    if workers == 1:
+        local = Solver(Tree(config, deals), chance)
+        keys.update(local.good_keys)
+    else:
+        for idx in range(workers):
+            parent, child = multiprocessing.Pipe()
+            shard = deals[idx::workers]
+            proc = multiprocessing.Process(
+                target=serve, args=(child, config, shard, chance)
+            )
+            proc.start()
+            pipes.append(parent)
+            procs.append(proc)
+    offsets: Dict[Hashable, int] = {}
+    try:
+        for conn in pipes:
+            message = conn.recv()
+            if isinstance(message, Exception):
+                raise message
+            keys.update(message)
+        info: List[int] = []
+        for key, count in keys.items():
+            offsets[key] = len(info)
+            info.extend([len(offsets) - 1] * count)
+        good_info, good_counts = np.array(info), np.array(list(keys.values()))
+        regrets, totals = np.zeros(len(info)), np.zeros(len(info))
+        if local is not None:
+            local.bind(offsets)
+        for conn in pipes:
+            conn.send(offsets)
+        for iteration in range(1, iterations + 1):
+            good = matched(regrets, good_info, good_counts)
+            if local is not None:
+                results = [local.iterate(good, float(iteration))]
+            else:
+                for conn in pipes:
+                    conn.send(("iterate", good, float(iteration)))
+                results = [conn.recv() for conn in pipes]
+            for delta, weights in results:
+                regrets += delta
+                totals += weights
+            regrets = np.maximum(regrets, 0.0)
+        average = matched(totals, good_info, good_counts)
+        if local is not None:
+            value = local.evaluate(average)
+        else:
+            for conn in pipes:
+                conn.send(("evaluate", average, 0.0))
+            value = sum(conn.recv() for conn in pipes)
+    finally:
+        for conn in pipes:
+            with contextlib.suppress(OSError):
+                conn.send(None)
+        for proc in procs:
+            proc.join()
+    strategy = {
+        key: [float(p) for p in average[offsets[key] : offsets[key] + count]]
+        for key, count in keys.items()
+    }
+    return Solution(value, iterations, strategy)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--players", type=int, default=5)
+    parser.add_argument("--evil", type=int)
+    parser.add_argument("--quests", help="e.g. 2:1,3:1,2:1")
+    parser.add_argument(
+        "--roles", nargs="*", default=[], choices=avalon.Role.__members__
+    )
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+    base = avalon._default_rules.get(args.players, avalon.Rules(0, []))
+    rules = avalon.Rules(
+        args.evil if args.evil is not None else base.total_evil,
+        parse_quests(args.quests) if args.quests else base.quests,
+    )
+    if not rules.total_evil or not rules.quests:
+        parser.error("--evil and --quests are required for this table size")
+    solution = solve(
+        args.players,
+        rules,
+        [avalon.Role[role] for role in args.roles],
+        args.iterations,
+        args.workers,
+    )
+    print(f"Good wins {solution.value:.4f} over {len(solution.good)} good infosets")
+
+
+if __name__ == "__main__":
+    main()
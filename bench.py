@@ -0,0 +1,182 @@
+#! /usr/bin/python3
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+from typing import Awaitable, Callable, Dict, List, Set
+
+import avalon
+import avalon_cli
+import avalon_discord
+
+ROLES = [
+    avalon.Role.Merlin,
+    avalon.Role.Assassin,
+    avalon.Role.Percival,
+    avalon.Role.Morgana,
+]
+SEATS = range(5, 11)
+BROADCAST_SEATS = (5, 10, 100, 1000)
+
+
+class ScriptedPlayer(avalon.Player):
+    def __init__(self, name: str, rng: random.Random):
+        super().__init__(name)
+        self.rng = rng
+        self.roster: List[str] = []
+
+    async def send(self, msg: str) -> None:
+        pass
+
+    async def input_players(
+        self,
+        msg: str,
+        count: int,
+        exclude: Set[str],
+    ) -> List[str]:
+        names = [name for name in self.roster if name not in exclude]
+        return self.rng.sample(names if len(names) >= count else self.roster, count)
+
+    async def input_vote(self, msg: str) -> bool:
+        return self.rng.random() < 0.5
+
+
+def table(nplayers: int, rng: random.Random) -> List[avalon.Player]:
+    players = [ScriptedPlayer(f"p{seat}", rng) for seat in range(nplayers)]
+    for player in players:
+        player.roster = [other.name for other in players]
+    return [player for player in players]
+
+
+async def games_per_second(nplayers: int, games: int) -> float:
+    rng = random.Random(nplayers)
+    start = time.perf_counter()
+    for _ in range(games):
+        game = avalon.Game(table(nplayers, rng), ROLES, {avalon.Flag.Lady}, rng=rng)
+        await game.play()
+    return games / (time.perf_counter() - start)
+
+
+async def broadcasts_per_second(nplayers: int, count: int) -> float:
+    players = table(nplayers, random.Random(0))
+    msg = "The residing lord commander is p0"
+    start = time.perf_counter()
+    for _ in range(count):
+        await asyncio.gather(*[player.send(msg) for player in players])
+    return count / (time.perf_counter() - start)
+
+
+async def cli_round_trips(count: int) -> float:
+    done: "asyncio.Future[float]" = asyncio.Future()
+
+    async def handle(
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        player = avalon_cli.CliPlayer("bench", avalon_cli.LineReader(reader), writer)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            for _ in range(count):
+                await player.input_vote("Should p0 p1 go on a quest?")
+            done.set_result(time.perf_counter() - start)
+        player.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    lines = avalon_cli.LineReader(reader)
+    while not done.done():
+        try:
+            msg = await lines.read()
+        except ConnectionError:
+            break
+        if msg == "I":
+            writer.write(b"+\n")
+    writer.close()
+    server.close()
+    await server.wait_closed()
+    return count / await done
+
+
+async def views_per_second(nplayers: int, count: int) -> float:
+    options = [
+        avalon_discord.NominationOption(f"<@{seat}>", f"player {seat}")
+        for seat in range(nplayers)
+    ]
+    start = time.perf_counter()
+    for _ in range(count):
+        avalon_discord.NominationView(options)
+        avalon_discord.VoteView()
+    return count / (time.perf_counter() - start)
+
+
+async def best(repeat: int, run: Callable[[], Awaitable[float]]) -> float:
+    return max([await run() for _ in range(repeat)])
+
+
+async def run_suite(scale: float, repeat: int) -> Dict[str, float]:
+    def n(count: int) -> int:
+        return max(1, int(count * scale))
+
+    results: Dict[str, float] = {}
+    for seats in SEATS:
+        results[f"games_per_s.{seats}"] = await best(
+            repeat, lambda: games_per_second(seats, n(200))
+        )
+    for seats in BROADCAST_SEATS:
+        results[f"broadcasts_per_s.{seats}"] = await best(
+            repeat, lambda: broadcasts_per_second(seats, n(100_000) // seats)
+        )
+    results["cli_round_trips_per_s"] = await best(
+        repeat, lambda: cli_round_trips(n(5000))
+    )
+    for seats in (5, 10):
+        results[f"discord_views_per_s.{seats}"] = await best(
+            repeat, lambda: views_per_second(seats, n(2000))
+        )
+    return results
+
+
+def regressions(
+    results: Dict[str, float], baseline: Dict[str, float], threshold: float
+) -> List[str]:
+    return [
+        f"{name}: {results[name]:.0f}/s vs {rate:.0f}/s"
+        for name, rate in sorted(baseline.items())
+        if name in results and results[name] < rate * (1 - threshold)
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+    results = asyncio.run(run_suite(args.scale, args.repeat))
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    if args.baseline is None:
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    slower = regressions(results, baseline, args.threshold)
+    for line in slower:
+        print(f"Regression: {line}", file=sys.stderr)
+    if slower:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#! /usr/bin/python3
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from typing import Awaitable, Callable
+
+import avalon_cli
+
+Reader = Callable[[], Awaitable[str]]
+
+
+def legacy_reader(reader: asyncio.StreamReader) -> Reader:
+    async def read() -> str:
+        data = b""
+        while not data.endswith(b"\n"):
+            data += await reader.read(0x1000)
+        return data.decode().strip()
+
+    return read
+
+
+def buffered_reader(reader: asyncio.StreamReader) -> Reader:
+    return avalon_cli.LineReader(reader).read
+
+
+async def loopback(
+    make_reader: Callable[[asyncio.StreamReader], Reader],
+    count: int,
+    size: int,
+    pipelined: bool,
+) -> float:
+    done: "asyncio.Future[None]" = asyncio.Future()
+
+    async def handle(
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        read = make_reader(reader)
+        for _ in range(count):
+            await read()
+            if not pipelined:
+                writer.write(b"I\n")
+        done.set_result(None)
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    line = b"x" * size + b"\n"
+    start = time.perf_counter()
+    if pipelined:
+        writer.write(line * count)
+        await writer.drain()
+    else:
+        for _ in range(count):
+            writer.write(line)
+            await reader.readexactly(2)
+    await done
+    elapsed = time.perf_counter() - start
+    writer.close()
+    server.close()
+    await server.wait_closed()
+    return count / elapsed
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def idle_client_cpu(duration: float) -> float:
+    connected: "asyncio.Future[None]" = asyncio.Future()
+    done: "asyncio.Future[None]" = asyncio.Future()
+
+    async def handle(
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        await reader.readline()
+        writer.write(avalon_cli.frame(avalon_cli.TEXT, b"Waiting for the table"))
+        connected.set_result(None)
+        await reader.read()
+        done.set_result(None)
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            f"import avalon_cli; avalon_cli.client('idle', ('127.0.0.1', {port}))",
+        ],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+    )
+    await connected
+    await asyncio.sleep(0.1)
+    baseline = cpu_seconds(proc.pid)
+    await asyncio.sleep(duration)
+    used = cpu_seconds(proc.pid) - baseline
+    proc.kill()
+    proc.wait()
+    await done
+    server.close()
+    return used / duration
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--size", type=int, default=32)
+    parser.add_argument("--idle", type=float, default=2.0)
+    args = parser.parse_args()
+    runs = [
+        ("legacy ping-pong", legacy_reader, False),
+        ("buffered ping-pong", buffered_reader, False),
+        ("buffered pipelined", buffered_reader, True),
+    ]
+    for title, make_reader, pipelined in runs:
+        rate = await loopback(make_reader, args.count, args.size, pipelined)
+        print(f"{title}: {rate:.0f} msg/s")
+    cpu = await idle_client_cpu(args.idle)
+    print(f"idle client: {cpu:.1%} cpu")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -4,6 +4,8 @@ import contextlib
 import enum
 import functools
 import itertools
+import os
+import pathlib
 from typing import (
     AsyncIterator,
     Callable,
@@ -36,7 +38,10 @@ class InputChannel(Generic[T]):
         self._prod = asyncio.Future()
 
     async def consume(self) -> T:
-        self._prod.set_result(None)
+        if self._cons.cancelled():
+            self._cons = asyncio.Future()
+        if not self._prod.done():
+            self._prod.set_result(None)
         value = await self._cons
         self._cons = asyncio.Future()
         return value
@@ -254,6 +259,18 @@ class TestAvalon:
             assert not await game.prep_quest(Vote.FALSE)
             assert await game.prep_quest(Vote.TRUE)
 
+    @pytest.mark.asyncio
+    async def test_nomination_invalid(self) -> None:
+        with self.game([]) as game:
+            commander = game.tplayers[0]
+            await commander.nominate(["nobody"])
+            await commander.expect_msg("Unknown players: nobody")
+            await commander.nominate(["p0", "p1"])
+            await commander.expect_msg("Select exactly 1 player")
+            await commander.nominate(["p1"])
+            await game.submit_votes(Vote.TRUE)
+            assert await game.tplayers[0].quest_goes()
+
     @pytest.mark.asyncio
     async def test_nomination_force(self) -> None:
         with self.game([]) as game:
@@ -371,3 +388,233 @@ class TestAvalon:
                 await visited_by.expect_msg(
                     avalon.Game.lady_reveal(nominate, roles[i].value.side)
                 )
+
+
+class TestSelection:
+    def test_selection_error(self) -> None:
+        roster = ["p0", "p1", "p2"]
+        assert avalon.selection_error(["p1", "p2"], roster, 2, {"p0"}) is None
+        assert avalon.selection_error(["p1"], roster, 2, set()) is not None
+        assert avalon.selection_error(["p1", "p1"], roster, 2, set()) is not None
+        assert avalon.selection_error(["p1", "p9"], roster, 2, set()) is not None
+        assert avalon.selection_error(["p0", "p1"], roster, 2, {"p0"}) is not None
+        assert avalon.selection_error(["p0", "p1"], roster, 2, {"p0", "p2"}) is None
+
+
+class TestEngine:
+    @staticmethod
+    def engine() -> avalon.Engine:
+        roles = [avalon.Role.Servant, avalon.Role.Minion]
+        engine = avalon.Engine(roles, RULES_1V1, set())
+        engine.start()
+        return engine
+
+    def test_quick_game(self) -> None:
+        engine = self.engine()
+        for _ in range(NR_QUESTS_QUICK):
+            (prompt,) = engine.pending_decisions()
+            assert prompt.phase is avalon.Phase.NOMINATE
+            engine.apply(prompt.answer_seats([prompt.seat]))
+            for prompt in engine.pending_decisions():
+                engine.apply(prompt.answer_vote(True))
+            (prompt,) = engine.pending_decisions()
+            assert prompt.phase is avalon.Phase.BETRAY
+            engine.apply(prompt.answer_vote(False))
+        assert engine.state.winner is avalon.Side.GOOD
+        assert engine.pending_decisions() == []
+        events = engine.drain()
+        assert isinstance(events[0], avalon.Dealt)
+        assert events[-1] == avalon.GameWon(avalon.Side.GOOD)
+
+    def test_invalid_decision(self) -> None:
+        engine = self.engine()
+        (prompt,) = engine.pending_decisions()
+        with pytest.raises(ValueError):
+            engine.apply(avalon.Decision(avalon.Phase.VOTE, 0, vote=True))
+        with pytest.raises(ValueError):
+            engine.apply(prompt.answer_seats([0, 1]))
+        with pytest.raises(ValueError):
+            engine.apply(prompt.answer_seats([2]))
+        with pytest.raises(ValueError):
+            other = 1 - prompt.seat
+            engine.apply(avalon.Decision(avalon.Phase.NOMINATE, other, seats=(0,)))
+
+    def test_skip_lady(self) -> None:
+        roles = [avalon.Role.Servant, avalon.Role.Minion]
+        engine = avalon.Engine(roles, RULES_1V1, {avalon.Flag.Lady})
+        engine.start()
+        for _ in range(avalon.LADY_BEGINS_AFTER + 1):
+            (prompt,) = engine.pending_decisions()
+            engine.apply(prompt.answer_seats([prompt.seat]))
+            for prompt in engine.pending_decisions():
+                engine.apply(prompt.answer_vote(True))
+            (prompt,) = engine.pending_decisions()
+            engine.apply(prompt.answer_vote(prompt.seat == 1))
+        (prompt,) = engine.pending_decisions()
+        assert prompt.phase is avalon.Phase.LADY
+        engine.apply(prompt.answer_seats(()))
+        assert engine.state.lady == prompt.seat
+        assert engine.state.phase is avalon.Phase.NOMINATE
+        assert avalon.LadySkipped(prompt.seat) in engine.drain()
+
+    def test_lady_exclude(self) -> None:
+        roles = [avalon.Role.Servant, avalon.Role.Minion]
+        engine = avalon.Engine(roles, RULES_1V1, {avalon.Flag.Lady})
+        engine.start()
+        ladies: List[avalon.Prompt] = []
+        while len(ladies) < 2:
+            (prompt,) = engine.pending_decisions()
+            if prompt.phase is avalon.Phase.LADY:
+                ladies.append(prompt)
+                if len(ladies) == 1:
+                    with pytest.raises(ValueError):
+                        engine.apply(prompt.answer_seats([prompt.seat]))
+                engine.apply(prompt.answer_seats([1 - prompt.seat]))
+                continue
+            engine.apply(prompt.answer_seats([prompt.seat]))
+            for prompt in engine.pending_decisions():
+                engine.apply(prompt.answer_vote(True))
+            (prompt,) = engine.pending_decisions()
+            engine.apply(prompt.answer_vote(prompt.seat == 1))
+        assert ladies[1].exclude == {0, 1}
+
+
+class TestSeating:
+    def test_known_seats(self) -> None:
+        roles = list(avalon.Role) + [avalon.Role.Minion, avalon.Role.Servant]
+        seating = avalon.Seating(roles)
+        for seat, role in enumerate(roles):
+            expected = [
+                other
+                for other, other_role in enumerate(roles)
+                if other != seat and other_role.value.key in role.value.know
+            ]
+            assert seating.known_seats(seat) == expected
+            assert seating.side(seat) is role.value.side
+
+    def test_unique(self) -> None:
+        roles = [avalon.Role.Merlin, avalon.Role.Minion, avalon.Role.Minion]
+        seating = avalon.Seating(roles)
+        assert seating.unique(avalon.Role.Merlin) == 0
+        assert seating.unique(avalon.Role.Minion) is None
+        assert seating.unique(avalon.Role.Assassin) is None
+
+    @pytest.mark.asyncio
+    async def test_indexes(self) -> None:
+        roles = (avalon.Role.Merlin, avalon.Role.Minion, avalon.Role.Minion)
+        seating = avalon.seating_for(roles)
+        assert seating is avalon.seating_for(roles)
+        assert seating.seats(avalon.Role.Minion) == [1, 2]
+        assert seating.seats(avalon.Role.Percival) == []
+        named = seating.named(["a", "b", "c"])
+        assert named.seat("c") == 2
+        assert named.roles == seating.roles
+        assert seating.names == ()
+        game = Game([])
+        assert game.engine.seating is game.seating
+        assert game.seating.seat("p1") == 1
+
+
+class TestBatch:
+    @staticmethod
+    async def initial_info(batch: int) -> List[Tuple[List[str], int]]:
+        players = [Player(f"p{i}") for i in range(2)]
+        roles = [avalon.Role.Merlin, avalon.Role.Assassin]
+        game_players: List[avalon.Player] = [p for p in players]
+        game = avalon.Game(
+            game_players, roles, {avalon.Flag.NoQuests}, RULES_1V1, batch=batch
+        )
+        await game.play()
+        return [
+            (list(p.msgs), 4 if role is avalon.Role.Merlin else 2)
+            for p, role in game.player_map
+            if isinstance(p, Player)
+        ]
+
+    @pytest.mark.asyncio
+    async def test_coalesce(self) -> None:
+        for msgs, nr_lines in await self.initial_info(1000):
+            assert len(msgs) == 1
+            assert len(msgs[0].splitlines()) == nr_lines
+
+    @pytest.mark.asyncio
+    async def test_limit(self) -> None:
+        for msgs, nr_lines in await self.initial_info(50):
+            assert len(msgs) == nr_lines // 2
+            assert all(len(msg) <= 50 for msg in msgs)
+            assert len("\n".join(msgs).splitlines()) == nr_lines
+
+
+class TestDeadlines:
+    @staticmethod
+    def game(deadlines: avalon.Deadlines) -> Tuple[avalon.Game, List[Player]]:
+        players = [Player(f"p{i}") for i in range(2)]
+        game_players: List[avalon.Player] = [p for p in players]
+        game = avalon.Game(game_players, [], None, RULES_1V1, deadlines=deadlines)
+        return game, players
+
+    @pytest.mark.asyncio
+    async def test_timeout(self) -> None:
+        game, players = self.game(avalon.Deadlines(0.02, warnings=(0.01,)))
+        await asyncio.wait_for(game.play(), 5)
+        assert game.engine.state.winner is avalon.Side.GOOD
+        assert "You have 0.01 seconds left to decide" in players[0].msgs
+        assert "p0 ran out of time" in players[1].msgs
+
+    @pytest.mark.asyncio
+    async def test_budget(self) -> None:
+        game, players = self.game(avalon.Deadlines(60.0, budget=0.0))
+        await asyncio.wait_for(game.play(), 5)
+        assert game.engine.state.winner is avalon.Side.GOOD
+        assert not any("seconds left" in msg for msg in players[0].msgs)
+
+    @pytest.mark.asyncio
+    async def test_answer_in_time(self) -> None:
+        game, players = self.game(avalon.Deadlines(5.0))
+        task = asyncio.create_task(game.play())
+        commander = players[0]
+        await commander.nominate([players[1].name])
+        for player in players:
+            await player.vote(False)
+        assert await players[0].quest_goes() is False
+        assert "ran out of time" not in " ".join(players[0].msgs)
+        task.cancel()
+
+
+class TestCheckpoint:
+    @pytest.mark.asyncio
+    async def test_resume(self, tmp_path: pathlib.Path) -> None:
+        path = str(tmp_path / "game.jsonl")
+        checkpoint = avalon.Checkpoint(path, {"table": 1})
+        with TestAvalon.game([]) as game:
+            game.checkpoint = checkpoint
+            for _ in range(NR_QUESTS_QUICK - 1):
+                await game.run_quest(False)
+        assert checkpoint.file is not None
+        checkpoint.file.close()
+        with open(path, "a") as f:
+            f.write('[["nominate",0,')
+        snapshot = avalon.Checkpoint.load(path)
+        assert snapshot.meta == {"table": 1}
+        assert snapshot.players == ["p0", "p1"]
+        players = [Player(name) for name in snapshot.players]
+        restored = avalon.Game(
+            [p for p in players],
+            [],
+            snapshot.flags,
+            snapshot.rules,
+            checkpoint=avalon.Checkpoint(path),
+            deal=snapshot.roles,
+        )
+        restored.replay(snapshot.decisions)
+        assert restored.engine.state == game.engine.state
+        task = asyncio.create_task(restored.play())
+        await players[0].expect_msg("The kingdom has been restored!")
+        commander = players[restored.engine.state.commander]
+        await commander.nominate([commander.name])
+        for player in players:
+            await player.vote(True)
+        await commander.vote(False)
+        assert await players[0].victory() is avalon.Side.GOOD
+        await task
+        assert not os.path.exists(path)
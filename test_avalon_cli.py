@@ -0,0 +1,449 @@
+import asyncio
+import contextlib
+import json
+import os
+import pathlib
+import tempfile
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+import pytest
+
+import avalon_cli
+import avalon_log
+import avalon_metrics
+
+Connection = Tuple[avalon_cli.LineReader, asyncio.StreamWriter]
+Pair = Tuple[Connection, Connection]
+Player = Tuple[avalon_cli.CliPlayer, avalon_cli.FrameReader, asyncio.StreamWriter]
+
+
+async def read_all(reader: avalon_cli.LineReader) -> List[str]:
+    received = []
+    while True:
+        try:
+            received.append(await reader.read())
+        except ConnectionError:
+            return received
+
+
+@contextlib.asynccontextmanager
+async def loopback() -> AsyncIterator[Pair]:
+    accepted: "asyncio.Future[Connection]" = asyncio.Future()
+
+    async def handle(
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        accepted.set_result((avalon_cli.LineReader(reader), writer))
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    yield await accepted, (avalon_cli.LineReader(reader), writer)
+    writer.close()
+    server.close()
+    await server.wait_closed()
+
+
+@contextlib.asynccontextmanager
+async def framed() -> AsyncIterator[Player]:
+    async with loopback() as ((lines, writer), (reader, client)):
+        server = avalon_cli.FrameReader(lines.reader)
+        player = avalon_cli.CliPlayer("p0", server, writer, "token")
+        yield player, avalon_cli.FrameReader(reader.reader), client
+
+
+async def greet(hello: str) -> List[str]:
+    server = await asyncio.start_server(avalon_cli.Server().handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(hello.encode() + b"\n")
+    received = await read_all(avalon_cli.LineReader(reader))
+    writer.close()
+    server.close()
+    await server.wait_closed()
+    return received
+
+
+async def framed_bot(port: int, name: str) -> Dict[str, Any]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"{avalon_cli.HELLO}{name}\n".encode())
+    frames = avalon_cli.FrameReader(reader)
+    state: Dict[str, Any] = {}
+    last = -1
+    while True:
+        kind, payload = await frames.read()
+        if kind == avalon_cli.STATE:
+            assert last != avalon_cli.STATE
+        last = kind
+        if kind == avalon_cli.VOTE:
+            answer = "+"
+        elif kind == avalon_cli.PLAYERS:
+            prompt = json.loads(payload)
+            names = [n for n in prompt["roster"] if n not in prompt["exclude"]]
+            answer = " ".join(names[: prompt["count"]])
+        elif kind == avalon_cli.STATE:
+            state = json.loads(payload)
+            continue
+        elif kind == avalon_cli.QUIT:
+            break
+        else:
+            continue
+        reply = {"id": json.loads(payload)["id"], "answer": answer}
+        writer.write(avalon_cli.frame_json(avalon_cli.REPLY, reply))
+    writer.close()
+    return state
+
+
+async def text_bot(port: int, name: str, roster: List[str]) -> Dict[str, Any]:
+    counts = {"one": 1, "two": 2, "three": 3}
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"{name}\n".encode())
+    lines = avalon_cli.LineReader(reader)
+    last = ""
+    while True:
+        line = await lines.read()
+        if line == "Q":
+            break
+        if line.startswith("P"):
+            last = line
+        elif line == "I":
+            words = last.split()
+            count = next((counts[w] for w in words if w in counts), 0)
+            answer = " ".join(roster[:count]) if "Select" in last else "+"
+            writer.write(answer.encode() + b"\n")
+    writer.close()
+    return {}
+
+
+class TestSpectators:
+    @pytest.mark.asyncio
+    async def test_stream(self) -> None:
+        gallery = avalon_cli.Gallery(limit=3)
+        async with loopback() as ((_, writer), (reader, _)):
+            gallery.join(writer)
+            assert len(gallery) == 1
+            for idx in range(5):
+                gallery.publish(f"message {idx}")
+                await asyncio.sleep(0)
+            gallery.close()
+            assert await read_all(reader) == [f"Pmessage {idx}" for idx in range(5)]
+        assert len(gallery) == 0
+
+    @pytest.mark.asyncio
+    async def test_drop_oldest(self) -> None:
+        gallery = avalon_cli.Gallery(limit=3)
+        async with loopback() as ((_, writer), (reader, _)):
+            gallery.join(writer)
+            for idx in range(10):
+                gallery.publish(f"message {idx}")
+            gallery.close()
+            assert await read_all(reader) == [
+                "P[7 messages skipped]",
+                "Pmessage 7",
+                "Pmessage 8",
+                "Pmessage 9",
+            ]
+
+    @pytest.mark.asyncio
+    async def test_unknown_table(self) -> None:
+        hello = avalon_cli.SPECTATE + "3"
+        assert await greet(hello) == ["PThere is no table 3"]
+
+
+class TestOutbox:
+    @pytest.mark.asyncio
+    async def test_backpressure(self) -> None:
+        async with loopback() as ((_, writer), (reader, _)):
+            outbox = avalon_cli.Outbox(writer, high=0x10000, low=0x1000)
+            await outbox.put(b"first\n")
+            flood = b"x" * 0x2000000 + b"\n"
+            reader.buffer.limit = len(flood)
+            blocked = asyncio.create_task(outbox.put(flood))
+            await asyncio.sleep(0.05)
+            assert not blocked.done()
+            assert await reader.read() == "first"
+            assert len(await reader.read()) == len(flood) - 1
+            await blocked
+            outbox.close()
+            await outbox.task
+
+    @pytest.mark.asyncio
+    async def test_disconnect(self) -> None:
+        async with loopback() as ((_, writer), (_, client)):
+            outbox = avalon_cli.Outbox(writer)
+            client.close()
+            with pytest.raises(ConnectionError):
+                for _ in range(100):
+                    await outbox.put(b"line\n")
+                    await asyncio.sleep(0.01)
+
+
+class TestResume:
+    @pytest.mark.asyncio
+    async def test_reissue_prompt(self) -> None:
+        async with loopback() as ((lines, writer), (reader, client)):
+            player = avalon_cli.CliPlayer("p0", lines, writer, "token")
+            await player.send("one\ntwo")
+            assert await reader.read() == "Pone"
+            assert await reader.read() == "Ptwo"
+            client.close()
+            vote = asyncio.create_task(player.input_vote("three?"))
+            await asyncio.sleep(0.05)
+            async with loopback() as ((lines, writer), (reader, client)):
+                player.resume(lines, writer, 2)
+                assert await reader.read() == "Pthree?"
+                assert await reader.read() == "S3"
+                assert await reader.read() == "I"
+                client.write(b"+\n")
+                assert await vote
+                player.close()
+                assert await reader.read() == "Q"
+
+    @pytest.mark.asyncio
+    async def test_replay_limit(self) -> None:
+        async with loopback() as ((lines, writer), _):
+            player = avalon_cli.CliPlayer("p0", lines, writer, "token")
+            for idx in range(avalon_cli.REPLAY + 4):
+                await player.send(f"message {idx}")
+            async with loopback() as ((lines, writer), (reader, _)):
+                player.resume(lines, writer, 0)
+                player.close()
+                received = await read_all(reader)
+        assert received[0] == "P[4 messages lost]"
+        assert received[1] == "Pmessage 4"
+        assert received[-2:] == [f"S{avalon_cli.REPLAY + 4}", "Q"]
+        assert len(received) == avalon_cli.REPLAY + 3
+
+    @pytest.mark.asyncio
+    async def test_unknown_session(self) -> None:
+        hello = avalon_cli.RESUME + "0123 4"
+        assert await greet(hello) == ["PUnknown session", "Q"]
+
+
+class TestFrames:
+    def test_split(self) -> None:
+        data = avalon_cli.frame(avalon_cli.TEXT, b"a\nb") + avalon_cli.frame_json(
+            avalon_cli.REPLY, {"id": 1, "answer": "+"}
+        )
+        buffer = avalon_cli.LineBuffer(4)
+        frames: List[Tuple[int, bytes]] = []
+        for idx in range(len(data)):
+            buffer.feed(data[idx : idx + 1])
+            frames.extend(buffer.frames())
+        assert frames == [
+            (avalon_cli.TEXT, b"a\nb"),
+            (avalon_cli.REPLY, b'{"id":1,"answer":"+"}'),
+        ]
+        buffer.feed(avalon_cli.FRAME.pack(avalon_cli.MAX_FRAME + 1, avalon_cli.TEXT))
+        with pytest.raises(ConnectionError):
+            list(buffer.frames())
+
+    def test_lines(self) -> None:
+        buffer = avalon_cli.LineBuffer(8)
+        buffer.feed(b"one\ntw")
+        assert list(buffer.lines()) == ["one"]
+        buffer.feed(b"o\nthree\n\nfour")
+        assert list(buffer.lines()) == ["two", "three", ""]
+        buffer.feed(b"\n")
+        assert list(buffer.lines()) == ["four"]
+        assert (buffer.start, buffer.end, buffer.scan) == (0, 0, 0)
+
+    def test_bad_lines(self) -> None:
+        buffer = avalon_cli.LineBuffer(8)
+        buffer.feed(b"\xff\xfe\n")
+        assert list(buffer.lines()) == ["\ufffd\ufffd"]
+        buffer.feed(b"x" * (avalon_cli.MAX_LINE + 1))
+        with pytest.raises(ConnectionError):
+            list(buffer.lines())
+
+    def test_compaction(self) -> None:
+        buffer = avalon_cli.LineBuffer(8)
+        buffer.feed(b"abc\ndef")
+        assert list(buffer.lines()) == ["abc"]
+        buffer.reserve(4)
+        assert len(buffer.buf) == 8
+        assert (buffer.start, buffer.end, buffer.scan) == (0, 3, 3)
+        buffer.feed(b"g\n")
+        assert list(buffer.lines()) == ["defg"]
+
+    def test_growth(self) -> None:
+        buffer = avalon_cli.LineBuffer(4)
+        line = b"x" * 100
+        buffer.feed(line[:3])
+        assert list(buffer.lines()) == []
+        buffer.feed(line[3:] + b"\n")
+        assert len(buffer.buf) >= 101
+        assert list(buffer.lines()) == [line.decode()]
+
+    @pytest.mark.asyncio
+    async def test_prompt(self) -> None:
+        async with framed() as (player, frames, client):
+            player.roster = ["p0", "p1", "p2"]
+            await player.send("one\ntwo")
+            assert await frames.read() == (avalon_cli.TEXT, b"one\ntwo")
+            task = asyncio.create_task(player.input_players("Pick", 2, {"p1"}))
+            kind, payload = await frames.read()
+            assert kind == avalon_cli.PLAYERS
+            assert json.loads(payload) == {
+                "id": 1,
+                "text": "Pick",
+                "roster": ["p0", "p1", "p2"],
+                "count": 2,
+                "exclude": ["p1"],
+            }
+            client.write(
+                avalon_cli.frame_json(avalon_cli.REPLY, {"id": 0, "answer": "p1"})
+                + avalon_cli.frame(avalon_cli.REPLY, b"garbage")
+                + avalon_cli.frame_json(avalon_cli.REPLY, {"id": 1, "answer": "p0 p2"})
+            )
+            assert await task == ["p0", "p2"]
+
+    @pytest.mark.asyncio
+    async def test_strict_reply(self) -> None:
+        async with framed() as (player, frames, client):
+            player.roster = ["p0", "p1", "p2"]
+            task = asyncio.create_task(player.input_players("Pick", 1, {"p1"}))
+            for ident, answer in enumerate(["p1", "p0"], 1):
+                kind, payload = await frames.read()
+                assert json.loads(payload)["id"] == ident
+                reply = {"id": ident, "answer": answer}
+                client.write(avalon_cli.frame_json(avalon_cli.REPLY, reply))
+                if ident == 1:
+                    assert await frames.read() == (avalon_cli.TEXT, b"Cannot select p1")
+            assert await task == ["p0"]
+
+    def test_complete(self) -> None:
+        names = ["alice", "albert", "bob"]
+        assert avalon_cli.complete("b", names) == "bob"
+        assert avalon_cli.complete("Ali", names) == "alice"
+        assert avalon_cli.complete("al", names) == "al"
+        assert avalon_cli.complete("albert", names) == "albert"
+
+
+class TestServer:
+    @pytest.mark.asyncio
+    async def test_mixed_protocols(self, tmp_path: pathlib.Path) -> None:
+        path = str(tmp_path / "games.avlog")
+        log = avalon_log.LogWriter(path)
+        server = avalon_cli.Server(5, [], deadlines=None, log=log)
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        roster = [f"p{seat}" for seat in range(5)]
+        bots = [framed_bot(port, name) for name in roster[:3]]
+        bots += [text_bot(port, name, roster) for name in roster[3:]]
+        states = await asyncio.wait_for(asyncio.gather(*bots), 10)
+        assert all(state["phase"] == "done" for state in states[:3])
+        assert len(server.sessions) == 0
+        log.close()
+        (record,) = avalon_log.games([path])
+        assert record.winner is not None
+        listener.close()
+        await listener.wait_closed()
+
+    @pytest.mark.asyncio
+    async def test_lobby_prune(self) -> None:
+        server = avalon_cli.Server(5, [], deadlines=None)
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        _, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"p0\n")
+        while not server.lobby:
+            await asyncio.sleep(0.01)
+        (gone,) = server.lobby
+        writer.close()
+        while not gone.reader.at_eof():
+            await asyncio.sleep(0.01)
+        _, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"p1\n")
+        await asyncio.wait_for(gone.outbox.task, 1)
+        assert [player.name for player in server.lobby] == ["p1"]
+        writer.close()
+        listener.close()
+        await listener.wait_closed()
+
+    @pytest.mark.asyncio
+    async def test_metrics_port_taken(self) -> None:
+        taken = await asyncio.start_server(lambda r, w: None, "127.0.0.1", 0)
+        port = taken.sockets[0].getsockname()[1]
+        registry = avalon_metrics.Registry()
+        await asyncio.wait_for(
+            avalon_cli.serve_metrics(registry, ("127.0.0.1", port)), 1
+        )
+        taken.close()
+        await taken.wait_closed()
+
+
+class TestLegacy:
+    @pytest.mark.asyncio
+    async def test_pipelined_replies(self) -> None:
+        async with loopback() as ((lines, writer), (_, client)):
+            player = avalon_cli.CliPlayer("p0", lines, writer)
+            client.write(b"+\n-\n")
+            assert await player.input_vote("first?")
+            assert not await player.input_vote("second?")
+
+    @pytest.mark.asyncio
+    async def test_late_reply(self) -> None:
+        async with loopback() as ((lines, writer), (_, client)):
+            player = avalon_cli.CliPlayer("p0", lines, writer)
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(player.input_players("Pick", 2, set()), 0.05)
+            client.write(b"p0 p1\n+\n")
+            assert await player.input_vote("Vote?")
+
+
+class TestStdin:
+    @pytest.mark.asyncio
+    async def test_regular_file(self) -> None:
+        with tempfile.TemporaryFile() as f:
+            f.write(b"+\np0 p1\n")
+            f.seek(0)
+            stdin = avalon_cli.StdinReader(f.fileno())
+            assert await stdin.read() == "+"
+            assert await stdin.read() == "p0 p1"
+            assert not stdin.pollable
+            with pytest.raises(EOFError):
+                await stdin.read()
+
+
+class TestClient:
+    @pytest.mark.asyncio
+    async def test_expired_prompt(self, capsys: pytest.CaptureFixture[str]) -> None:
+        replies: "asyncio.Queue[Tuple[int, bytes]]" = asyncio.Queue()
+
+        async def handle(
+            reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+        ) -> None:
+            await reader.readline()
+            writer.write(avalon_cli.frame_json(avalon_cli.VOTE, vote(1)))
+            writer.write(avalon_cli.frame(avalon_cli.TEXT, b"You ran out of time"))
+            writer.write(avalon_cli.frame_json(avalon_cli.VOTE, vote(2)))
+            await replies.put(await avalon_cli.FrameReader(reader).read())
+            writer.write(avalon_cli.frame(avalon_cli.QUIT, b""))
+            await writer.drain()
+
+        def vote(ident: int) -> Dict[str, Any]:
+            return {"id": ident, "text": f"Vote {ident}?"}
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        rfd, wfd = os.pipe()
+        session = avalon_cli.Session("p0")
+        task = asyncio.create_task(
+            avalon_cli.converse(
+                session, ("127.0.0.1", port), avalon_cli.StdinReader(rfd)
+            )
+        )
+        while "Vote 2?" not in capsys.readouterr().out:
+            await asyncio.sleep(0.01)
+        os.write(wfd, b"+\n")
+        kind, payload = await asyncio.wait_for(replies.get(), 1)
+        assert kind == avalon_cli.REPLY
+        assert json.loads(payload) == {"id": 2, "answer": "+"}
+        await asyncio.wait_for(task, 1)
+        assert session.done
+        os.close(rfd)
+        os.close(wfd)
+        server.close()
+        await server.wait_closed()
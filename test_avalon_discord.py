@@ -0,0 +1,171 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, List, Tuple, cast
+
+import discord
+import pytest
+
+import avalon_discord
+
+
+def recorder(
+    log: List[str], delay: float = 0.0
+) -> Callable[[str], Callable[[], Awaitable[str]]]:
+    def make(tag: str) -> Callable[[], Awaitable[str]]:
+        async def send() -> str:
+            log.append(tag)
+            await asyncio.sleep(delay)
+            return tag
+
+        return send
+
+    return make
+
+
+class TestScheduler:
+    @pytest.mark.asyncio
+    async def test_round_robin(self) -> None:
+        scheduler = avalon_discord.SendScheduler(concurrency=1)
+        log: List[str] = []
+        send = recorder(log)
+        items: List[Tuple[str, str]] = [
+            ("a", "a1"),
+            ("a", "a1"),
+            ("a", "a2"),
+            ("a", "a2"),
+            ("b", "b1"),
+            ("b", "b1"),
+        ]
+        await asyncio.gather(*(scheduler.send(t, r, send(r)) for t, r in items))
+        assert log == ["a1", "b1", "a2", "b1", "a1", "a2"]
+        assert scheduler.depth() == 0
+
+    @pytest.mark.asyncio
+    async def test_token_bucket(self) -> None:
+        scheduler = avalon_discord.SendScheduler(route_rate=20.0, route_burst=2)
+        stamps: List[float] = []
+
+        async def send() -> None:
+            stamps.append(time.monotonic())
+
+        await asyncio.gather(*(scheduler.send("t", "r", send) for _ in range(4)))
+        assert stamps[1] - stamps[0] < 0.04
+        assert stamps[2] - stamps[0] >= 0.04
+        assert stamps[3] - stamps[0] >= 0.09
+
+    @pytest.mark.asyncio
+    async def test_route_order(self) -> None:
+        scheduler = avalon_discord.SendScheduler()
+        log: List[str] = []
+        replies = await asyncio.gather(
+            *(
+                scheduler.send("t", "r", recorder(log, 0.01 * (5 - i))(str(i)))
+                for i in range(5)
+            )
+        )
+        assert log == replies == [str(i) for i in range(5)]
+
+    @pytest.mark.asyncio
+    async def test_cancel(self) -> None:
+        scheduler = avalon_discord.SendScheduler(concurrency=1)
+        log: List[str] = []
+        send = recorder(log, 0.01)
+        first = asyncio.create_task(scheduler.send("t", "r", send("first")))
+        queued = asyncio.create_task(scheduler.send("t", "r", send("queued")))
+        while not log:
+            await asyncio.sleep(0)
+        first.cancel()
+        queued.cancel()
+        assert await scheduler.send("t", "r", send("last")) == "last"
+        assert log == ["first", "last"]
+        assert scheduler.depth() == 0
+
+
+class TestViews:
+    @pytest.mark.asyncio
+    async def test_vote_view(self) -> None:
+        table = avalon_discord.Table(1, 2, 3)
+        view = avalon_discord.VoteView()
+        view.update(table, 10, False, None)
+        ids = [button.custom_id for button in view.buttons.values()]
+        assert ids == ["3:10:yes", "3:10:no"]
+        view.update(table, 11, True, avalon_discord.Vote.NO)
+        yes, no = view.buttons.values()
+        assert (yes.custom_id, yes.disabled) == ("3:11:yes", True)
+        assert no.style is discord.ButtonStyle.success
+        assert len(view.children) == 2
+
+    @pytest.mark.asyncio
+    async def test_nomination_view(self) -> None:
+        table = avalon_discord.Table(1, 2, 3)
+        options = [avalon_discord.NominationOption(m, m) for m in ("a", "b", "c")]
+        view = avalon_discord.NominationView(options)
+        view.reset({"b"})
+        view.update(table, 10, ["a"], 2)
+        shown = [b.custom_id for b in view.buttons.values() if b in view.children]
+        assert shown == ["3:10:a", "3:10:c"]
+        a, _, c = view.buttons.values()
+        assert a.disabled and a.style is discord.ButtonStyle.success
+        assert not c.disabled
+        view.reset(set())
+        view.update(table, 11, [], 1)
+        assert len(view.children) == 3
+        assert not any(button.disabled for button in view.buttons.values())
+
+    @pytest.mark.asyncio
+    async def test_forget_views(self) -> None:
+        client = discord.Client(intents=discord.Intents.none())
+        store = client._connection._view_store
+        table = avalon_discord.Table(1, 2, 3)
+        view = avalon_discord.VoteView()
+        for message_id in (100, 101):
+            view.update(table, message_id, False, None)
+            store.add_view(view, message_id)
+        avalon_discord.forget_views(client, 100)
+        assert 100 not in store._views
+        assert 100 not in store._synced_message_views
+        assert 101 in store._views
+        avalon_discord.forget_views(cast(discord.Client, object()), 101)
+        await client.close()
+
+
+class TestTable:
+    INTERACTION = cast(discord.Interaction, object())
+
+    def test_parse_custom_id(self) -> None:
+        table = avalon_discord.Table(1, 2, 3)
+        custom_id = table.custom_id(7, "a:b")
+        assert avalon_discord.Table.parse_custom_id(custom_id) == (3, 7, "a:b")
+        for bad in ("", "3", "3:7", "x:7:yes", "3:y:yes"):
+            assert avalon_discord.Table.parse_custom_id(bad) is None
+
+    @pytest.mark.asyncio
+    async def test_resolve(self) -> None:
+        table = avalon_discord.Table(1, 2, 3)
+        token, fut = table.open_prompt("p0")
+        assert not table.resolve(token, "p1", self.INTERACTION)
+        assert not table.resolve(token + 1, "p0", self.INTERACTION)
+        assert not fut.done()
+        assert table.resolve(token, "p0", self.INTERACTION)
+        assert fut.result() is self.INTERACTION
+        assert not table.resolve(token, "p0", self.INTERACTION)
+
+    @pytest.mark.asyncio
+    async def test_two_tables(self) -> None:
+        tables = {t: avalon_discord.Table(1, 2, t) for t in (3, 4)}
+        prompts = {t: table.open_prompt("p0") for t, table in tables.items()}
+        token, _ = prompts[4]
+        parsed = avalon_discord.Table.parse_custom_id(tables[4].custom_id(token, "+"))
+        assert parsed is not None
+        assert tables[parsed[0]].resolve(parsed[1], "p0", self.INTERACTION)
+        assert prompts[4][1].done()
+        assert not prompts[3][1].done()
+
+    @pytest.mark.asyncio
+    async def test_cancelled_prompt(self) -> None:
+        table = avalon_discord.Table(1, 2, 3)
+        token, fut = table.open_prompt("p0")
+        fut.cancel()
+        await asyncio.sleep(0)
+        assert table.waiters == {}
+        assert not table.resolve(token, "p0", self.INTERACTION)
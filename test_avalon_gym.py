@@ -0,0 +1,102 @@
+from typing import Dict, List
+
+import numpy as np
+import numpy.typing as npt
+import pytest
+
+import avalon
+import avalon_gym
+
+ROLES = [avalon.Role.Merlin, avalon.Role.Assassin, avalon.Role.Morgana]
+PHASE_CODES = {phase: code for code, phase in enumerate(avalon_gym.PHASES)}
+
+
+def engines(env: avalon_gym.VecEnv) -> List[avalon.Engine]:
+    return [engine(env, row) for row in range(env.num_envs)]
+
+
+def engine(env: avalon_gym.VecEnv, row: int) -> avalon.Engine:
+    roles = [avalon_gym.ROLES[code] for code in env.roles[row]]
+    engine = avalon.Engine(roles, env.rules, {avalon.Flag.Lady})
+    engine.start()
+    return engine
+
+
+def check(env: avalon_gym.VecEnv, row: int, engine: avalon.Engine) -> None:
+    state = engine.state
+    assert env.phase[row] == PHASE_CODES[state.phase]
+    assert env.quest[row] == state.quest
+    assert env.commander[row] == state.commander
+    assert list(env.score[row]) == [state.score[side] for side in avalon.Side]
+    assert env.lady[row] == state.lady
+
+
+def decisions(
+    obs: Dict[str, npt.NDArray[np.generic]],
+    actions: avalon_gym.Actions,
+    row: int,
+    engine: avalon.Engine,
+) -> List[avalon.Decision]:
+    nominate, votes, betray, target = actions
+    made = []
+    for prompt in engine.pending_decisions():
+        assert obs["act"][row, prompt.seat]
+        if prompt.phase is avalon.Phase.NOMINATE:
+            seats = avalon.mask_seats(int(nominate[row]))
+            made.append(prompt.answer_seats(seats))
+        elif prompt.phase is avalon.Phase.VOTE:
+            made.append(prompt.answer_vote(bool(votes[row, prompt.seat])))
+        elif prompt.phase is avalon.Phase.BETRAY:
+            made.append(prompt.answer_vote(bool(betray[row, prompt.seat])))
+        else:
+            made.append(prompt.answer_seats([int(target[row])]))
+    return made
+
+
+class TestVecEnv:
+    def test_matches_engine(self) -> None:
+        env = avalon_gym.VecEnv(32, 7, ROLES, {avalon.Flag.Lady}, seed=1)
+        rng = np.random.default_rng(1)
+        obs = env.reset()
+        games = engines(env)
+        finished = 0
+        for _ in range(300):
+            actions = avalon_gym.random_actions(env, obs, rng)
+            made = [decisions(obs, actions, row, games[row]) for row in range(32)]
+            obs, rewards, done = env.step(*actions)
+            for row, game in enumerate(games):
+                for decision in made[row]:
+                    game.apply(decision)
+                if not done[row]:
+                    check(env, row, game)
+                    assert not rewards[row].any()
+                    continue
+                finished += 1
+                winner = game.state.winner
+                assert winner is not None
+                for seat, role in enumerate(game.state.roles):
+                    won = role.value.side is winner
+                    assert rewards[row, seat] == (1.0 if won else -1.0)
+                games[row] = engine(env, row)
+        assert finished > 100
+
+    def test_seeded(self) -> None:
+        def run(seed: int) -> List[float]:
+            env = avalon_gym.VecEnv(16, 5, seed=seed)
+            rng = np.random.default_rng(seed)
+            obs = env.reset()
+            total = []
+            for _ in range(50):
+                obs, rewards, _ = env.step(*avalon_gym.random_actions(env, obs, rng))
+                total.append(float(rewards.sum()))
+            return total
+
+        assert run(4) == run(4)
+
+    def test_invalid(self) -> None:
+        env = avalon_gym.VecEnv(2, 5)
+        env.reset()
+        with pytest.raises(ValueError):
+            env.step(nominate=np.array([0b1, 0b11]))
+        with pytest.raises(ValueError):
+            env.step(nominate=np.array([0b1100000, 0b11]))
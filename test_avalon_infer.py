@@ -0,0 +1,65 @@
+import math
+import random
+from typing import List
+
+import avalon
+import avalon_infer
+import avalon_sim
+
+ROLES = [
+    avalon.Role.Merlin,
+    avalon.Role.Percival,
+    avalon.Role.Assassin,
+    avalon.Role.Morgana,
+    avalon.Role.Oberon,
+]
+CONFIG = avalon_sim.SimConfig(nplayers=8, roles=ROLES, flags={avalon.Flag.Lady})
+
+
+class WatchedGame(avalon_sim.SimGame):
+    def __init__(self, seed: int):
+        super().__init__(CONFIG, random.Random(seed))
+        engine = self.engine
+        self.beliefs = [avalon_infer.Beliefs(engine.state.roles)] + [
+            avalon_infer.Beliefs.seated(engine, seat) for seat in range(8)
+        ]
+
+    def observe(self, event: avalon.Event) -> None:
+        super().observe(event)
+        for beliefs in self.beliefs:
+            beliefs.observe(event)
+
+
+def codes(roles: List[avalon.Role]) -> List[int]:
+    return [avalon_infer.ROLE_CODES[role] for role in roles]
+
+
+class TestBeliefs:
+    def test_assignments(self) -> None:
+        deal = sorted(codes(ROLES + [avalon.Role.Servant] * 3))
+        table = avalon_infer.assignments(tuple(deal))
+        assert len(table) == math.factorial(8) // math.factorial(3)
+        assert len({bytes(row) for row in table}) == len(table)
+
+    def test_private_knowledge(self) -> None:
+        game = WatchedGame(2)
+        roles = game.engine.state.roles
+        merlin = roles.index(avalon.Role.Merlin)
+        odds = game.beliefs[1 + merlin].evil_odds()
+        evil = [float(role.value.side is avalon.Side.EVIL) for role in roles]
+        assert all(map(math.isclose, odds, evil))
+        servant = roles.index(avalon.Role.Servant)
+        assert len(game.beliefs[1 + servant]) < len(game.beliefs[0])
+
+    def test_consistent(self) -> None:
+        for seed in range(5):
+            game = WatchedGame(seed)
+            game.play()
+            truth = codes(game.engine.state.roles)
+            for beliefs in game.beliefs:
+                assert truth in beliefs.roles.tolist()
+                assert math.isclose(sum(beliefs.evil_odds()), 3)
+            if game.assassinated:
+                merlin = game.engine.state.roles.index(avalon.Role.Merlin)
+                spectator = game.beliefs[0].role_odds()[merlin]
+                assert spectator == {avalon.Role.Merlin: 1.0}
@@ -0,0 +1,59 @@
+import os
+import pathlib
+import random
+
+import avalon
+import avalon_log
+import avalon_sim
+
+CONFIG = avalon_sim.SimConfig(
+    nplayers=7,
+    roles=[avalon.Role.Merlin, avalon.Role.Assassin, avalon.Role.Percival],
+    flags={avalon.Flag.Lady},
+)
+
+
+class TestLog:
+    def test_round_trip(self, tmp_path: pathlib.Path) -> None:
+        stats = avalon_sim.simulate(CONFIG, 60, seed=5, shard=25, log=str(tmp_path))
+        paths = sorted(str(path) for path in tmp_path.iterdir())
+        assert len(paths) == 3
+        records = list(avalon_log.games(paths))
+        assert len(records) == 60
+        for record in records:
+            assert record.winner is not None
+            assert avalon_log.rerun(record) is record.winner
+        summary = avalon_log.Summary().fold(paths)
+        assert summary.games == stats.games
+        assert summary.wins == stats.wins
+        assert summary.role_games == stats.role_games
+        assert summary.role_wins == stats.role_wins
+        assert summary.assassinations == stats.assassinations
+
+    def test_torn_tail(self, tmp_path: pathlib.Path) -> None:
+        path = str(tmp_path / "games.avlog")
+        with avalon_log.LogWriter(path) as writer:
+            game = avalon_sim.SimGame(CONFIG, random.Random(1), writer.recorder())
+            game.play()
+        size = os.path.getsize(path)
+        with open(path, "ab") as f:
+            f.write(avalon_log.HEADER.pack(1, avalon_log.START, 40) + b"\x07")
+        assert [r.winner for r in avalon_log.games([path])] == [game.winner]
+        assert os.path.getsize(path) > size
+
+    def test_reopen(self, tmp_path: pathlib.Path) -> None:
+        path = str(tmp_path / "games.avlog")
+        with avalon_log.LogWriter(path) as writer:
+            first = avalon_sim.SimGame(CONFIG, random.Random(1), writer.recorder())
+            first.play()
+            writer.recorder().started(first.engine.state)
+        with open(path, "ab") as f:
+            f.write(avalon_log.HEADER.pack(1, avalon_log.DECIDED, 5) + b"\x07")
+        with avalon_log.LogWriter(path) as writer:
+            assert writer.next_game == 2
+            second = avalon_sim.SimGame(CONFIG, random.Random(2), writer.recorder())
+            second.play()
+        ids = {game for game, _, _ in avalon_log.records(path)}
+        assert ids == {0, 1, 2}
+        winners = [r.winner for r in avalon_log.games([path])]
+        assert winners == [first.winner, second.winner]
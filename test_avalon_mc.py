@@ -0,0 +1,33 @@
+import pytest
+
+import avalon
+import avalon_mc
+
+
+class TestEstimate:
+    def test_seeded(self) -> None:
+        first = avalon_mc.estimate(7, 2000, seed=3)
+        second = avalon_mc.estimate(7, 2000, seed=3)
+        assert first == second
+        low, high = first.interval()
+        assert low < first.good < high
+
+    def test_loyal_evil(self) -> None:
+        tendencies = avalon_mc.Tendencies(betray=0.0)
+        result = avalon_mc.estimate(5, 1000, tendencies=tendencies)
+        assert result.good == 1.0
+        assert result.quest_good == [1.0, 1.0, 1.0]
+
+    def test_assassin(self) -> None:
+        tendencies = avalon_mc.Tendencies(betray=0.0, assassin_hit=1.0)
+        roles = [avalon.Role.Merlin, avalon.Role.Assassin]
+        result = avalon_mc.estimate(8, 1000, roles, tendencies=tendencies)
+        assert result.good == 0.0
+        assert result.assassinations == 1000
+
+    def test_custom_rules(self) -> None:
+        rules = avalon.Rules(1, [avalon.Quest(2, 1)] * 3)
+        result = avalon_mc.estimate(4, 5000, rules=rules)
+        assert 0.0 < result.good < 1.0
+        with pytest.raises(ValueError):
+            avalon_mc.estimate(4, 100, rules=avalon.Rules(1, [avalon.Quest(2, 1)] * 2))
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+import avalon
+import avalon_metrics
+from test_avalon import NR_QUESTS_QUICK, Game
+
+
+class TestMetrics:
+    def test_export(self) -> None:
+        registry = avalon_metrics.Registry(buckets=(0.5, 1.0))
+        registry.decision('a"b', "vote", 0.2)
+        registry.decision('a"b', "vote", 0.7)
+        registry.decision('a"b', "vote", 3.0)
+        lines = registry.export().splitlines()
+        assert "# TYPE avalon_decision_seconds histogram" in lines
+        prefix = 'avalon_decision_seconds_bucket{player="a\\"b",phase="vote",le='
+        assert prefix + '"0.5"} 1' in lines
+        assert prefix + '"1.0"} 2' in lines
+        assert prefix + '"+Inf"} 3' in lines
+        assert 'avalon_decision_seconds_count{player="a\\"b",phase="vote"} 3' in lines
+
+    def test_max_series(self) -> None:
+        registry = avalon_metrics.Registry(max_series=2)
+        registry.decision("a", "vote", 0.1)
+        registry.decision("b", "vote", 0.1)
+        registry.decision("a", "vote", 0.1)
+        registry.decision("c", "vote", 0.1)
+        players = [dict(key)["player"] for key in registry.decisions]
+        assert players == ["a", "c"]
+
+    @pytest.mark.asyncio
+    async def test_game(self) -> None:
+        registry = avalon_metrics.Registry()
+        game = Game([])
+        game.metrics = registry
+        task = asyncio.create_task(game.play())
+        assert await game.run_game([False] * NR_QUESTS_QUICK) is avalon.Side.GOOD
+        await task
+        phases = {dict(key)["phase"]: hist for key, hist in registry.phases.items()}
+        assert phases["nominate"].count == NR_QUESTS_QUICK
+        assert phases["vote"].count == NR_QUESTS_QUICK
+        assert phases["betray"].count == NR_QUESTS_QUICK
+        votes = registry.decisions[(("player", "p0"), ("phase", "vote"))]
+        assert votes.count == NR_QUESTS_QUICK
@@ -0,0 +1,34 @@
+import pytest
+
+import avalon
+import avalon_sim
+
+CONFIG = avalon_sim.SimConfig(
+    nplayers=5,
+    roles=[avalon.Role.Merlin, avalon.Role.Assassin],
+    flags={avalon.Flag.Lady},
+)
+
+
+class TestSim:
+    def test_counts(self) -> None:
+        stats = avalon_sim.simulate(CONFIG, 50, shard=20)
+        assert stats.games == 50
+        assert sum(stats.wins.values()) == 50
+        assert stats.role_games[avalon.Role.Merlin] == 50
+        assert stats.role_games[avalon.Role.Servant] == 100
+        assert sum(stats.quest_wins[0].values()) == 50
+
+    def test_seeded(self) -> None:
+        first = avalon_sim.simulate(CONFIG, 30, seed=7, shard=10)
+        second = avalon_sim.simulate(CONFIG, 30, seed=7, shard=10)
+        assert first == second
+
+    def test_process_pool(self) -> None:
+        serial = avalon_sim.simulate(CONFIG, 40, seed=3, shard=10)
+        pooled = avalon_sim.simulate(CONFIG, 40, workers=2, seed=3, shard=10)
+        assert serial == pooled
+
+    def test_no_quests(self) -> None:
+        with pytest.raises(ValueError):
+            avalon_sim.SimConfig(5, [], {avalon.Flag.NoQuests})
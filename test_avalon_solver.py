@@ -0,0 +1,36 @@
+import pytest
+
+import avalon
+import avalon_solver
+from test_avalon import RULES_1V1
+
+SMALL = avalon.Rules(1, [avalon.Quest(2, 1), avalon.Quest(2, 1), avalon.Quest(3, 1)])
+
+
+class TestSolve:
+    def test_1v1(self) -> None:
+        first = avalon_solver.solve(2, RULES_1V1, iterations=100)
+        second = avalon_solver.solve(2, RULES_1V1, iterations=100)
+        assert first == second
+        assert 0.45 < first.value < 0.55
+        for probs in first.good.values():
+            assert sum(probs) == pytest.approx(1.0)
+
+    def test_assassin(self) -> None:
+        roles = [avalon.Role.Merlin, avalon.Role.Assassin]
+        plain = avalon_solver.solve(4, SMALL, iterations=30)
+        assassin = avalon_solver.solve(4, SMALL, roles, iterations=30)
+        assert 0.0 < assassin.value < plain.value < 1.0
+
+    def test_workers(self) -> None:
+        serial = avalon_solver.solve(4, SMALL, iterations=10)
+        parallel = avalon_solver.solve(4, SMALL, iterations=10, workers=2)
+        assert parallel.value == pytest.approx(serial.value)
+        assert parallel.good.keys() == serial.good.keys()
+
+    def test_too_large(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr(avalon_solver, "MAX_STATES", 1000)
+        with pytest.raises(ValueError):
+            avalon_solver.solve(4, SMALL, iterations=1)
+        with pytest.raises(ValueError):
+            avalon_solver.solve(4, SMALL, iterations=1, workers=2)